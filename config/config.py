@@ -1,42 +1,149 @@
+import json
+import os
 import numpy as np
-import pandas as pd
-import psycopg2
 
 ## config and file locations
+# every setting below can be overridden by an environment variable BUOY_<NAME> (e.g. BUOY_N_WORKERS=4)
+# or by a key of the same name in a json settings file (BUOY_SETTINGS, default config/settings.json).
+# The WPM frequency table is only read on first use (see __getattr__), db connections live in data.db
+settings_path = os.environ.get('BUOY_SETTINGS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings.json'))
+_file_settings = {}
+if os.path.exists(settings_path):
+    with open(settings_path, 'r') as f:
+        _file_settings = json.load(f)
+
+def setting(name, default):
+    # environment first, then the settings file, then the default. Env strings are cast to the default's type
+    env = os.environ.get(f"BUOY_{name.upper()}")
+    if env is None:
+        return _file_settings.get(name, default)
+    if isinstance(default, bool):
+        return env.strip().lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, (int, float)):
+        return type(default)(env)
+    if isinstance(default, (dict, list, tuple)):
+        return json.loads(env)
+    return env
+
 # db conns
-conn = psycopg2.connect(
-    dbname="postgres",
-    user="Jacob",
-    password="",
-    host="localhost",
-    port="5432"
-)
-cur = conn.cursor()
+db_params = {
+    "dbname": "postgres",
+    "user": "Jacob",
+    "password": "",
+    "host": "localhost",
+    "port": "5432"
+}
+db_params.update(_file_settings.get('db_params', {}))
+db_params = {key: os.environ.get(f"BUOY_DB_{key.upper()}", value) for key, value in db_params.items()}
+# pooled connections per process (data.db): pool size, extra overflow connections and wait for a free one (seconds)
+db_pool_size = setting('db_pool_size', 4)
+db_max_overflow = setting('db_max_overflow', 4)
+db_pool_timeout = setting('db_pool_timeout', 30)
 
 # NOAA active stations xml
-noaa_stations_path = r"D:\\Buoy_work\\Config_Data\\activestations.xml"
+noaa_stations_path = setting('noaa_stations_path', r"D:\\Buoy_work\\Config_Data\\activestations.xml")
 
 # NOAA api
-url = r'https://www.ndbc.noaa.gov/data/realtime2/'
+url = setting('url', r'https://www.ndbc.noaa.gov/data/realtime2/')
 
 # wave frequency bin path
-wpm_path = r'D:\\Buoy_work\\Config_Data\\WPM_spectra.xlsx'
+wpm_path = setting('wpm_path', r'D:\\Buoy_work\\Config_Data\\WPM_spectra.xlsx')
 
 # local save folders
-noaa_rt_path = r"D:\\Buoy_work\\Raws Storage\\NOAA_Raws\\rt"
-noaa_year_path = r"D:\\Buoy_work\\Raws Storage\\NOAA_Raws\\year"
-tidal_path = r"D:\\Buoy_work\\Raws Storage\\Tidal_Raws"
-stations_path = r'D:\\Buoy_work\\Config_Data\\stations.json'
-cdip_path = r"D:\\Buoy_work\\Raws Storage\\CDIP Raws"
-
-# pull in the wpm freqs and bin sizes
-wpm_data = pd.read_excel(wpm_path,header=None,skiprows=1)
-noaa_freqs = np.array(pd.Series(wpm_data.iloc[:,1]))
-noaa_bandwidths = np.array(pd.Series(wpm_data.iloc[:,2]))
-
-# create 360 directional points to iterate over for NOAA buoys
-directional_pnts_deg = np.arange(0,360,5)
-directional_pnts = np.deg2rad(directional_pnts_deg)
-theta_grid = directional_pnts[None, :]
-delta_theta_deg = 5
-delta_theta_rad = np.deg2rad(delta_theta_deg)
\ No newline at end of file
+noaa_rt_path = setting('noaa_rt_path', r"D:\\Buoy_work\\Raws Storage\\NOAA_Raws\\rt")
+noaa_year_path = setting('noaa_year_path', r"D:\\Buoy_work\\Raws Storage\\NOAA_Raws\\year")
+tidal_path = setting('tidal_path', r"D:\\Buoy_work\\Raws Storage\\Tidal_Raws")
+stations_path = setting('stations_path', r'D:\\Buoy_work\\Config_Data\\stations.json')
+cdip_path = setting('cdip_path', r"D:\\Buoy_work\\Raws Storage\\CDIP Raws")
+cache_path = setting('cache_path', r"D:\\Buoy_work\\Cache")
+# reuse parsed raw files (fetch_data/parsed_cache.py) while the source files are unchanged
+parsed_cache = setting('parsed_cache', True)
+
+# directional resolution in degrees for D(f, theta), one of 1, 2, 5 or 10
+# calc_D can override it per run, the basis for each resolution is cached in processes.calc_D
+direction_resolution_deg = setting('direction_resolution_deg', 5)
+
+# spectra storage mode: 'rows' writes spectra_parameters/spectra_directional,
+# 'packed' writes one spectra_packed row per timestep
+spectra_storage = setting('spectra_storage', 'rows')
+# keep the packed D array in 'packed' mode, otherwise only the Fourier inputs are stored
+packed_store_D = setting('packed_store_D', False)
+
+# worker processes for spectral processing (1 runs serially in the caller's process)
+n_workers = setting('n_workers', 1)
+# timesteps written per transaction by calc_D
+commit_batch_size = setting('commit_batch_size', 500)
+
+# bootstrap confidence for modality_boot (0 replicates turns it off). Replicates stop classifying rows once
+# their label is settled: measured at 200 replicates it is ~10-20 ms per timestep on one core, 15-30x the
+# plain chunk cost (~2-3 min for a year of hourly data)
+modality_bootstrap_replicates = setting('modality_bootstrap_replicates', 200)
+# degrees of freedom behind the r1/r2/alpha1/alpha2 estimates
+modality_bootstrap_dof = setting('modality_bootstrap_dof', 32)
+modality_bootstrap_seed = setting('modality_bootstrap_seed', 0)
+
+# storm matching: 'client' matches in pandas, 'server' runs one set-based statement in postgres
+storm_match_mode = setting('storm_match_mode', 'client')
+
+# CO-OPS tide api, point tide_api_url at a local server to test the fetcher offline
+tide_api_url = setting('tide_api_url', "https://api.tidesandcurrents.noaa.gov/api/prod/datagetter")
+# concurrent requests, request rate cap (requests per second) and per-request timeout (seconds)
+tide_max_workers = setting('tide_max_workers', 8)
+tide_requests_per_sec = setting('tide_requests_per_sec', 5)
+tide_timeout = setting('tide_timeout', 30)
+# retries with exponential backoff on connection errors, 429 and 5xx
+tide_retries = setting('tide_retries', 5)
+tide_backoff = setting('tide_backoff', 0.5)
+# hourly_height is verified data published 1-2 months late: a month with gaps is refetched until it is
+# this many days past its end, then stored as is
+tide_verification_lag_days = setting('tide_verification_lag_days', 90)
+
+# NDBC realtime2 fetch (base url above): concurrent requests across stations, per-request timeout (seconds),
+# retries with backoff, and whether the fetched files are also saved as-is under noaa_rt_path
+rt_max_concurrency = setting('rt_max_concurrency', 16)
+rt_timeout = setting('rt_timeout', 30)
+rt_retries = setting('rt_retries', 3)
+rt_backoff = setting('rt_backoff', 0.5)
+rt_save_raw = setting('rt_save_raw', False)
+
+# frequency bands (Hz, [low, high)) that get their own mean direction and spread in df_txt_calcs,
+# stored as time_steps.mean_dir_<band> / dir_spread_<band> (create_tables.migrate adds the columns)
+direction_bands = setting('direction_bands', {'swell': (0.0, 0.1), 'sea': (0.1, 1.0)})
+
+def load_wpm_table():
+    # (freqs, bandwidths) from the WPM sheet, cached as binary arrays next to the other caches
+    # and re-read only when the sheet's mtime changes
+    source_mtime = os.path.getmtime(wpm_path)
+    cache_file = os.path.join(cache_path, 'wpm', 'wpm_freqs.npz')
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            if cached['source_mtime'] == source_mtime:
+                return cached['freqs'], cached['bandwidths']
+
+    import pandas as pd
+    wpm_data = pd.read_excel(wpm_path,header=None,skiprows=1)
+    freqs = np.array(pd.Series(wpm_data.iloc[:,1]), dtype=float)
+    bandwidths = np.array(pd.Series(wpm_data.iloc[:,2]), dtype=float)
+
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    np.savez(cache_file, source_mtime=source_mtime, freqs=freqs, bandwidths=bandwidths)
+    return freqs, bandwidths
+
+def _wpm_table():
+    freqs, bandwidths = load_wpm_table()
+    globals()['noaa_bandwidths'] = bandwidths
+    return freqs
+
+# lazily created module attributes, built on first access and then stored as plain globals
+# so later lookups skip __getattr__
+_lazy = {
+    'noaa_freqs': lambda: _wpm_table(),
+    'noaa_bandwidths': lambda: load_wpm_table()[1],
+}
+
+def __getattr__(name):
+    if name in _lazy:
+        value = _lazy[name]()
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,156 @@
+import io
+import re
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+
+# modules
+import config.config as c
+
+def copy_merge(cur, df, target_table, conflict_cols, select_exprs=None, na_rep=''):
+    # stream a dataframe into a temp staging table with COPY, then merge into the target table
+    # select_exprs lets a column be transformed on the way out of staging (e.g. COALESCE)
+    if df.empty:
+        return 0
+
+    columns = list(df.columns)
+    staging_table = f"_stage_{target_table.split('.')[-1]}"
+
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False, na_rep=na_rep)
+    buf.seek(0)
+
+    # staging copies the column types only, no keys, defaults or sequences
+    cur.execute(f"""
+        CREATE TEMP TABLE {staging_table} ON COMMIT DROP AS
+        SELECT {', '.join(columns)} FROM {target_table} WITH NO DATA
+    """)
+    cur.copy_expert(f"COPY {staging_table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+    select_exprs = select_exprs or {}
+    select_list = ', '.join(select_exprs.get(col, col) for col in columns)
+    cur.execute(f"""
+        INSERT INTO {target_table} ({', '.join(columns)})
+        SELECT {select_list} FROM {staging_table}
+        ON CONFLICT ({', '.join(conflict_cols)}) DO NOTHING
+    """)
+    inserted = cur.rowcount
+    cur.execute(f"DROP TABLE {staging_table}")
+    return inserted
+
+# time_steps column -> df_txt column
+time_steps_columns = {
+    'wdir': 'WDIR', 'wspd': 'WSPD', 'gst': 'GST', 'wvht': 'WVHT', 'dpd': 'DPD', 'apd': 'APD', 'mwd': 'MWD',
+    'pres': 'PRES', 'atmp': 'ATMP', 'wtmp': 'WTMP', 'dewp': 'DEWP', 'vis': 'VIS', 'ptdy': 'PTDY', 'tide': 'TIDE',
+    'm0': 'm0', 'hm0': 'hm0', 'm_1': 'm_1', 'te': 'Te', 'p': 'P',
+    'm1': 'm1', 'm2': 'm2', 'm4': 'm4', 'tm01': 'Tm01', 'tm02': 'Tm02',
+    'spectral_width': 'width', 'spectral_narrowness': 'narrowness', 'fp': 'fp', 'tp': 'Tp',
+    'mean_dir': 'mean_dir', 'dir_spread': 'dir_spread',
+}
+
+def band_columns():
+    # mean direction and spread columns for each config.direction_bands band (mean_dir_swell, dir_spread_swell, ...),
+    # named the same in df_txt and time_steps. Band names become column names, so they must be plain identifiers
+    columns = []
+    for band in c.direction_bands:
+        if not re.fullmatch(r'[a-z][a-z0-9_]*', str(band)):
+            raise ValueError(f"Direction band name must be lowercase letters, digits and underscores: {band}")
+        columns += [f'mean_dir_{band}', f'dir_spread_{band}']
+    return columns
+
+def copy_time_steps(cur, df_txt, buoy_ids, source, met_source):
+    # bulk load df_txt into time_steps, buoy_ids is aligned to df_txt rows
+    # columns missing from df_txt and NaN values go in as NULL
+    # returns (inserted, skipped) where skipped rows already existed for (buoy_id, timestamp)
+    columns = dict(time_steps_columns, **{col: col for col in band_columns()})
+    df = df_txt.reindex(columns=list(columns.values()))
+    df.columns = list(columns.keys())
+    df.insert(0, 'timestamp', df_txt['datetime'].to_numpy())
+    df.insert(0, 'buoy_id', np.asarray(buoy_ids, dtype=np.int64))
+    df['source'] = source
+    df['met_source'] = met_source
+
+    inserted = copy_merge(cur, df, 'dirspec.time_steps', ['buoy_id', 'timestamp'])
+    return inserted, len(df) - inserted
+
+def copy_spectra_parameters(cur, time_step_ids, freqs, Ef, alpha1_met, alpha2_met, r1, r2):
+    # one row per (timestep, frequency), built straight from the (T, F) arrays
+    n_t, n_f = Ef.shape
+    df = pd.DataFrame({
+        'time_step_id': np.repeat(np.asarray(time_step_ids, dtype=np.int64), n_f),
+        'frequency': np.tile(np.asarray(freqs, dtype=float), n_t),
+        'alpha1': alpha1_met.ravel(),
+        'alpha2': alpha2_met.ravel(),
+        'r1': r1.ravel(),
+        'r2': r2.ravel(),
+        'energy_density': Ef.ravel(),
+    })
+    # nan angles and r values go in as NULL, nan energy stays a float NaN
+    return copy_merge(cur, df, 'dirspec.spectra_parameters', ['time_step_id', 'frequency'],
+                      select_exprs={'energy_density': "COALESCE(energy_density, 'NaN')"})
+
+def copy_spectra_directional(cur, time_step_ids, freqs, directions_deg, D):
+    # one row per (timestep, frequency, direction), built straight from the (T, F, n_dirs) array
+    n_t, n_f, n_dirs = D.shape
+    df = pd.DataFrame({
+        'time_step_id': np.repeat(np.asarray(time_step_ids, dtype=np.int64), n_f * n_dirs),
+        'frequency': np.tile(np.repeat(np.asarray(freqs, dtype=float), n_dirs), n_t),
+        'direction': np.tile(np.asarray(directions_deg, dtype=np.int64), n_t * n_f),
+        'spreading': D.ravel(),
+    })
+    return copy_merge(cur, df, 'dirspec.spectra_directional', ['time_step_id', 'frequency', 'direction'], na_rep='NaN')
+
+def pg_real_array(arr):
+    # format each row of a 2D array as a postgres real[] literal
+    arr = np.asarray(arr, dtype=np.float32).reshape(len(arr), -1)
+    return ['{' + ','.join(row) + '}' for row in arr.astype(str)]
+
+def copy_spectra_packed(cur, time_step_ids, Ef, alpha1_met, alpha2_met, r1, r2, D=None, keep_D=None):
+    # one row per timestep holding the Fourier inputs (and optionally D) as packed float32 arrays
+    df = pd.DataFrame({
+        'time_step_id': np.asarray(time_step_ids, dtype=np.int64),
+        'energy_density': pg_real_array(Ef),
+        'alpha1': pg_real_array(alpha1_met),
+        'alpha2': pg_real_array(alpha2_met),
+        'r1': pg_real_array(r1),
+        'r2': pg_real_array(r2),
+    })
+    if D is not None:
+        # frequency-major (F * n_dirs), NULL for timesteps where D is not kept
+        spreading = pd.Series(pg_real_array(D.reshape(len(D), -1)), dtype=object)
+        if keep_D is not None:
+            spreading[~np.asarray(keep_D, dtype=bool)] = None
+        df['spreading'] = spreading
+    return copy_merge(cur, df, 'dirspec.spectra_packed', ['time_step_id'])
+
+def update_time_step_status(cur, time_step_ids, modality, ingested, modality_conf=None, modality_ver=None):
+    # set the modality fields and spectra_ingested for a batch of timesteps with one UPDATE ... FROM (VALUES ...)
+    # modality_conf/modality_ver are left untouched when no confidence was computed
+    n = len(time_step_ids)
+    if n == 0:
+        return 0
+    ids = [int(ts_id) for ts_id in time_step_ids]
+    modality = [str(mod) for mod in modality]
+    ingested = [bool(ing) for ing in ingested]
+
+    if modality_conf is None:
+        rows = list(zip(ids, modality, ingested))
+        execute_values(cur, """
+            UPDATE dirspec.time_steps ts
+            SET modality_boot = v.modality_boot,
+                spectra_ingested = v.spectra_ingested
+            FROM (VALUES %s) AS v (id, modality_boot, spectra_ingested)
+            WHERE ts.id = v.id
+        """, rows, page_size=n)
+    else:
+        rows = list(zip(ids, modality, ingested, [float(conf) for conf in modality_conf], [modality_ver] * n))
+        execute_values(cur, """
+            UPDATE dirspec.time_steps ts
+            SET modality_boot = v.modality_boot,
+                spectra_ingested = v.spectra_ingested,
+                modality_conf = v.modality_conf,
+                modality_ver = v.modality_ver
+            FROM (VALUES %s) AS v (id, modality_boot, spectra_ingested, modality_conf, modality_ver)
+            WHERE ts.id = v.id
+        """, rows, page_size=n)
+    return cur.rowcount
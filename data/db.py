@@ -0,0 +1,101 @@
+import os
+import threading
+from contextlib import contextmanager
+import pandas as pd
+
+# modules
+import config.config as c
+
+# one bounded connection pool per process (SQLAlchemy's QueuePool behind a single engine).
+# A unit of work borrows one connection through session(): pandas reads (s.eng) and psycopg2
+# writes (s.cur) run on that same connection and transaction, and it goes back to the pool on exit.
+# The pool is rebuilt automatically in a forked child, init_worker does it explicitly
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+_local = threading.local()
+
+def get_engine():
+    global _engine, _engine_pid
+    with _engine_lock:
+        if _engine is not None and _engine_pid != os.getpid():
+            # inherited from the parent process, leave the parent's sockets alone
+            _engine.dispose(close=False)
+            _engine = None
+        if _engine is None:
+            from sqlalchemy import create_engine
+            from sqlalchemy.engine import URL
+            url = URL.create("postgresql+psycopg2", username=c.db_params["user"], password=c.db_params["password"] or None,
+                             host=c.db_params["host"], port=c.db_params["port"], database=c.db_params["dbname"])
+            _engine = create_engine(url, pool_size=c.db_pool_size, max_overflow=c.db_max_overflow,
+                                    pool_timeout=c.db_pool_timeout, pool_pre_ping=True)
+            _engine_pid = os.getpid()
+        return _engine
+
+def init_worker():
+    # process-pool initializer: drop any pool inherited from the parent so the worker opens its own
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose(close=False)
+        _engine = None
+
+def dispose():
+    # close every pooled connection, e.g. at the end of a run
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        _engine = None
+
+class Session:
+    # one pooled connection for a unit of work: eng for pandas/SQLAlchemy, conn/cur for psycopg2
+    def __init__(self, eng):
+        self.eng = eng
+        self.conn = eng.connection.dbapi_connection
+        self.cur = self.conn.cursor()
+        # an open SQLAlchemy transaction keeps pandas from committing on its own between reads
+        self._tx = eng.begin()
+
+    def commit(self):
+        self._tx.commit()
+        self._tx = self.eng.begin()
+
+    def rollback(self):
+        self._tx.rollback()
+        self._tx = self.eng.begin()
+
+@contextmanager
+def session(commit=True):
+    # commits on a clean exit (unless commit=False) and rolls back on an exception
+    eng = get_engine().connect()
+    s = Session(eng)
+    previous = getattr(_local, 'session', None)
+    _local.session = s
+    try:
+        yield s
+        if commit:
+            s.commit()
+    except BaseException:
+        s.rollback()
+        raise
+    finally:
+        _local.session = previous
+        s.cur.close()
+        # anything left uncommitted is rolled back when the connection goes back to the pool
+        eng.close()
+
+def current_session():
+    return getattr(_local, 'session', None)
+
+def read_sql(sql, params=None):
+    # runs on the thread's open session so reads see its uncommitted writes,
+    # otherwise borrows a pooled connection just for the read
+    from sqlalchemy import text
+    if isinstance(sql, str):
+        sql = text(sql)
+    s = current_session()
+    if s is not None:
+        return pd.read_sql(sql, s.eng, params=params)
+    with get_engine().connect() as eng:
+        return pd.read_sql(sql, eng, params=params)
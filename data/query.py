@@ -1,44 +1,17 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 from psycopg2.extras import execute_values
 import pandas as pd
-import psycopg2
 
-conn = psycopg2.connect(
-    dbname="postgres",
-    user="Jacob",
-    password="",
-    host="localhost",
-    port="5432"
-)
+# modules
+import data.db as db
+import data.ref_cache as rc
 
-CONN_STR = "postgresql+psycopg2://Jacob:@localhost:5432/postgres"
-engine = create_engine(CONN_STR)
-conn_eng = engine.connect() 
+# reads go through data.db, on the caller's open session when there is one
 
 def get_buoy_id(station_id):
-    # Get buoy ID (assumes station_id already inserted in buoys)
-    buoy_id = pd.read_sql(text("""SELECT id FROM dirspec.buoys WHERE station_id = :station_id
-        """), conn_eng, params={"station_id": station_id})
-    return buoy_id
-
-def insert_ts_row(cur, buoy_id, row):
-    from processes.utils import safe_val
-    cur.execute("""
-        INSERT INTO dirspec.time_steps (
-            buoy_id, timestamp, WDIR, WSPD, GST, WVHT, DPD, APD, MWD, PRES,
-            ATMP, WTMP, DEWP, VIS, PTDY, TIDE, m0, hm0, m_1, Te, P
-        )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (buoy_id, timestamp) DO NOTHING;
-    """, (
-        buoy_id[0], row['datetime'],
-        safe_val(row.get('WDIR')), safe_val(row.get('WSPD')), safe_val(row.get('GST')), safe_val(row.get('WVHT')),
-        safe_val(row.get('DPD')), safe_val(row.get('APD')), safe_val(row.get('MWD')), safe_val(row.get('PRES')),
-        safe_val(row.get('ATMP')), safe_val(row.get('WTMP')), safe_val(row.get('DEWP')), safe_val(row.get('VIS')),
-        safe_val(row.get('PTDY')), safe_val(row.get('TIDE')), safe_val(row.get('m0')), safe_val(row.get('hm0')),
-        safe_val(row.get('m_1')), safe_val(row.get('Te')), safe_val(row.get('P'))
-    ))
+    # Get buoy ID (assumes station_id already inserted in buoys), served from the reference cache
+    buoy_id = rc.get_buoy_id(station_id)
+    return pd.DataFrame({'id': [] if buoy_id is None else [buoy_id]})
 
 def insert_buoy(cur, meta_buoy):
     cur.execute("""
@@ -50,6 +23,9 @@ def insert_buoy(cur, meta_buoy):
     """, (
         meta_buoy['station_id'], meta_buoy['name'], meta_buoy['project']
     ))
+    # an existing buoy inserts nothing and the cached table stays valid
+    if cur.rowcount > 0:
+        rc.invalidate('buoys')
 
 def insert_deployment(cur, buoy_deploy):
     cur.execute("""
@@ -62,52 +38,91 @@ def insert_deployment(cur, buoy_deploy):
         int(buoy_deploy['buoy_id']), str(buoy_deploy['deployment_id']), buoy_deploy['start_time'], buoy_deploy['end_time'], 
         float(buoy_deploy['latitude']), float(buoy_deploy['longitude']), str(buoy_deploy['deployment_type']), (buoy_deploy['depth'])
     ))
+    if cur.rowcount > 0:
+        rc.invalidate('deployments')
+
+def upsert_realtime_deployment(cur, buoy_deploy):
+    # the station's single realtime deployment: inserted once, then only its time span grows.
+    # The position stays the one registered first
+    cur.execute("""
+        INSERT INTO dirspec.buoy_deployments (
+            buoy_id, deployment_id, start_time, end_time, lat, lon, deployment_type, depth
+        )
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (deployment_id) WHERE deployment_id LIKE 'NOAA-%%-rt'
+        DO UPDATE SET start_time = LEAST(buoy_deployments.start_time, EXCLUDED.start_time),
+                      end_time = GREATEST(buoy_deployments.end_time, EXCLUDED.end_time)
+        RETURNING buoy_id, deployment_id, start_time, end_time, lat, lon, deployment_type, depth, (xmax = 0) AS inserted;
+    """, (
+        int(buoy_deploy['buoy_id']), str(buoy_deploy['deployment_id']), buoy_deploy['start_time'], buoy_deploy['end_time'],
+        float(buoy_deploy['latitude']), float(buoy_deploy['longitude']), str(buoy_deploy['deployment_type']), (buoy_deploy['depth'])
+    ))
+    row = cur.fetchone()
+    columns = [col[0] for col in cur.description]
+    record = dict(zip(columns[:-1], row[:-1]))
+    if row[-1]:
+        rc.invalidate('deployments')
+    else:
+        # same row with a longer span, the loaded table is patched instead of reloaded
+        rc.put_deployment(record)
+
+def get_ingest_marks(cur, station_ids, source):
+    # {station_id: last ingested timestamp (naive UTC)} for the stations that have a mark
+    cur.execute("""
+        SELECT station_id, last_timestamp
+        FROM dirspec.ingest_marks
+        WHERE source = %s AND station_id = ANY(%s)
+    """, (source, [str(station_id) for station_id in station_ids]))
+    return {station_id: pd.Timestamp(last_timestamp) for station_id, last_timestamp in cur.fetchall()}
+
+def set_ingest_mark(cur, station_id, source, last_timestamp):
+    # move the station's mark forward, never back
+    cur.execute("""
+        INSERT INTO dirspec.ingest_marks (station_id, source, last_timestamp)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (station_id, source) DO UPDATE
+        SET last_timestamp = GREATEST(dirspec.ingest_marks.last_timestamp, EXCLUDED.last_timestamp),
+            updated_at = now()
+    """, (str(station_id), source, last_timestamp))
 
 def get_spec_ing_false(buoy_id):
-    df = pd.read_sql(text("""
+    df = db.read_sql(text("""
         SELECT timestamp
         FROM dirspec.time_steps
         WHERE buoy_id = :buoy_id AND (spectra_ingested = FALSE OR spectra_ingested IS NULL)
         ORDER BY timestamp
-    """), conn_eng, params={"buoy_id": buoy_id})
+    """), params={"buoy_id": buoy_id})
     return df
 
 def find_buoys_with_timestamp(storm_timestamp):   
-    df = pd.read_sql(text("""
+    df = db.read_sql(text("""
         SELECT ts.id, ts.timestamp, b.station_id, b.lat, b.lon  
         FROM dirspec.time_steps ts
         JOIN dirspec.buoys b on ts.buoy_id = b.id
         WHERE ts.timestamp BETWEEN (:storm_timestamp - INTERVAL '15 minutes')
                                AND (:storm_timestamp + INTERVAL '15 minutes')    
-    """), conn, params={"storm_timestamp": storm_timestamp})
+    """), params={"storm_timestamp": storm_timestamp})
     return df
 
 def find_stormtracks_with_timestamp(buoy_timestamp):
-    df = pd.read_sql(text("""
+    df = db.read_sql(text("""
         SELECT st.id, st.storm_id, st.timestamp, st.lat, st.lon, st.wind_speed, st.pressure, st.heading, st.speed, st.storm_type, s.storm_name
         FROM storms.storm_tracks st
         JOIN storms.storms s on st.storm_id = s.storm_id
         WHERE :buoy_timestamp BETWEEN (st.timestamp - INTERVAL '15 minutes')
                                   AND (st.timestamp + INTERVAL '15 minutes')    
-    """), conn, params={"buoy_timestamp": buoy_timestamp})   
+    """), params={"buoy_timestamp": buoy_timestamp})   
     return df
 
-def get_station_lat_lon(buoy_id, deployment_id):   
-    df = pd.read_sql(text("""
-        SELECT b.lat, b.lon
-        FROM dirspec.buoy_deployments b
-        WHERE b.buoy_id = :buoy_id  
-        AND b.deployment_id = :deployment_id    
-    """), conn_eng, params={"buoy_id": buoy_id, "deployment_id": deployment_id})  
-    return df    
+def get_station_lat_lon(buoy_id, deployment_id):
+    deployment = rc.get_deployment(buoy_id, deployment_id)
+    if deployment is None:
+        return pd.DataFrame(columns=['lat', 'lon'])
+    return pd.DataFrame({'lat': [deployment['lat']], 'lon': [deployment['lon']]})
 
 def get_storm_name(hurdat_storm_id):
-    df = pd.read_sql(text("""
-    SELECT s.storm_name
-    FROM storms.storms s
-    WHERE s.hurdat_storm_id = :hurdat_storm_id                      
-    """), conn, params={"hurdat_storm_id": hurdat_storm_id})
-    return df['storm_name']       
+    storm_name = rc.get_storm_name(hurdat_storm_id)
+    return pd.Series([] if storm_name is None else [storm_name], name='storm_name', dtype=object)
 
 def update_storm_match(cur, time_step_id, hurdat_storm_id, dist, storm_timestamp):
     execute_values(cur, """
@@ -116,4 +131,40 @@ def update_storm_match(cur, time_step_id, hurdat_storm_id, dist, storm_timestamp
         VALUES %s
         ON CONFLICT (time_step_id, storm_id) DO NOTHING;
     """, [(time_step_id, hurdat_storm_id, dist, storm_timestamp)
-    ])
\ No newline at end of file
+    ])
+
+def get_packed_spectrum(time_step_id, resolution_deg=None):
+    # rebuild the (frequency, direction) D matrix for one timestep stored in spectra_packed
+    import numpy as np
+    import config.config as c
+    import processes.utils as u
+    from processes.calc_D import compute_D
+
+    df = db.read_sql(text("""
+        SELECT energy_density, r1, r2, alpha1, alpha2, spreading
+        FROM dirspec.spectra_packed
+        WHERE time_step_id = :time_step_id
+    """), params={"time_step_id": str(time_step_id)})
+    if df.empty:
+        return None, None
+    row = df.iloc[0]
+    resolution_deg = resolution_deg or c.direction_resolution_deg
+
+    Ef = np.array(row['energy_density'], dtype=float)[None, :]
+
+    # D was stored packed at the requested resolution, just unpack it
+    if row['spreading'] is not None:
+        D = np.array(row['spreading'], dtype=float).reshape(Ef.shape[1], -1)
+        if D.shape[1] * resolution_deg == 360:
+            return D, D * Ef[0][:, None]
+
+    # otherwise (or at another resolution) run the stored Fourier inputs through the same math as calc_D
+    r1 = np.array(row['r1'], dtype=float)[None, :]
+    r2 = np.array(row['r2'], dtype=float)[None, :]
+    alpha1 = np.array(row['alpha1'], dtype=float)[None, :]
+    alpha1 = np.where(~np.isnan(alpha1), u.met_to_math_dir(alpha1), np.nan)
+    alpha2 = np.array(row['alpha2'], dtype=float)[None, :]
+    alpha2 = np.where(~np.isnan(alpha2), u.met_to_math_dir(alpha2), np.nan)
+
+    D, S = compute_D(Ef, alpha1, alpha2, r1, r2, resolution_deg)
+    return D[0], S[0]
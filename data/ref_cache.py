@@ -0,0 +1,64 @@
+from sqlalchemy import text
+
+# in-process cache of the small reference tables: dirspec.buoys, dirspec.buoy_deployments, storms.storms
+# each table is loaded whole on first use (or by preload) and kept until invalidate(), so a key that is
+# not in the table is answered with None without going back to the database. Writers that add rows
+# (query.insert_buoy, query.insert_deployment) invalidate the table, the next lookup reloads it once;
+# query.upsert_realtime_deployment patches an extended deployment in place with put_deployment
+_tables = {}
+_stats = {'hits': 0, 'misses': 0, 'loads': 0}
+
+_queries = {
+    'buoys': "SELECT id, station_id FROM dirspec.buoys",
+    'deployments': "SELECT buoy_id, deployment_id, start_time, end_time, lat, lon, deployment_type, depth FROM dirspec.buoy_deployments",
+    'storms': "SELECT hurdat_storm_id, storm_name FROM storms.storms",
+}
+
+def _load(table):
+    import data.db as db
+    df = db.read_sql(text(_queries[table]))
+    if table == 'buoys':
+        _tables[table] = dict(zip(df['station_id'].astype(str), df['id'].astype(int)))
+    elif table == 'deployments':
+        keys = zip(df['buoy_id'].astype(int), df['deployment_id'].astype(str))
+        _tables[table] = dict(zip(keys, df.to_dict('records')))
+    else:
+        _tables[table] = dict(zip(df['hurdat_storm_id'], df['storm_name']))
+    _stats['loads'] += 1
+
+def _lookup(table, key):
+    if table not in _tables:
+        _load(table)
+    if key in _tables[table]:
+        _stats['hits'] += 1
+        return _tables[table][key]
+    _stats['misses'] += 1
+    return None
+
+def preload(tables=('buoys', 'deployments', 'storms')):
+    for table in tables:
+        _load(table)
+
+def invalidate(table=None):
+    # drop one table (or all of them) so the next lookup reloads from the database
+    if table is None:
+        _tables.clear()
+    else:
+        _tables.pop(table, None)
+
+def put_deployment(record):
+    # keep a loaded deployments table current after an in-place update, without a reload
+    if 'deployments' in _tables:
+        _tables['deployments'][(int(record['buoy_id']), str(record['deployment_id']))] = record
+
+def cache_stats():
+    return dict(_stats)
+
+def get_buoy_id(station_id):
+    return _lookup('buoys', str(station_id))
+
+def get_deployment(buoy_id, deployment_id):
+    return _lookup('deployments', (int(buoy_id), str(deployment_id)))
+
+def get_storm_name(hurdat_storm_id):
+    return _lookup('storms', hurdat_storm_id)
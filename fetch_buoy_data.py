@@ -5,10 +5,11 @@ import config.config as c
 import processes.utils as u
 import processes.calc_D as calc_D
 import processes.storm_buoy_match as sbm
-from fetch_data.fetch_from_rt import fetch_from_rt
-from fetch_data.fetch_from_year import fetch_from_year
-from fetch_data.fetch_from_api import fetch_from_api
-from fetch_data.fetch_from_cdip import fetch_from_cdip
+import data.db as db
+import data.query as q
+import data.ref_cache as rc
+import processes.create_tables as ct
+import fetch_data.parsed_cache as pc
 
 # file name parameters
 file_station_id = [144]
@@ -22,57 +23,109 @@ start_date = pd.to_datetime('2021-01-01').tz_localize("UTC")
 end_date = pd.to_datetime('2021-12-31').tz_localize("UTC")
 save_is_storm = True
 
-for station_id, f_date, f_type, cdip_deployment in zip(file_station_id, file_date, file_type, cdip_deployments):
-    match f_type:
-        case 'noaa-rt':
-            df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2 = fetch_from_rt(station_id, f_date)
-        case 'noaa-year':
-            df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2, deployment_id = fetch_from_year(station_id, f_date)
-        case 'noaa-api':
-            df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2 = fetch_from_api(station_id, f_date)
-        case 'cdip':
-            df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2, deployment_id = fetch_from_cdip(station_id, cdip_deployment)
-        case _:
-            raise ValueError(f"Unsupported file_type entry: {f_type}")
-
-    # perform calcs for bulk parameters at each timestep
-    df_txt = u.df_txt_calcs(df_txt, df_data_spec)
-    print("Bulk wave parameters calculated.")
-
-    # get ENSO index values for the timesteps
-    df_txt = u.get_enso_index(df_txt)
-    print("ENSO index values assigned to timesteps.")
-
-    # get tidal values for the timesteps
-    df_txt = u.get_tidal_data(df_txt, deployment_id)
-    print("Tidal values assigned to timesteps.")
-
-    # move processed timesteps to database
-    cur = c.conn.cursor()
-    u.insert_time_steps(cur, df_txt, f_type)
-    c.conn.commit()
-    print("Timesteps uploaded to database if no conflict.")
-
-    # perform storm analysis at each timestep
-    df_txt, storm_dict = sbm.storm_buoy_match(cur, None, df_txt, 400, deployment_id )
-    print("Completed storm-buoy matches.")
-
-    # filter the timesteps to only unprocessed ones
-    # check for spectrum ingested flag across timesteps
-    unprocessed_timesteps = u.get_unprocessed_timesteps(cur, str(station_id))
-    if not unprocessed_timesteps:
-        continue
-
-    flat = [row[0] for row in unprocessed_timesteps if row and row[0] is not None]
-    dt_index = pd.to_datetime(flat, utc=True)
-
-    # select timesteps from the current data where ingested flag isn't set to true
-    df_data_spec = df_data_spec[df_data_spec['datetime'].isin(dt_index)].reset_index(drop=True)
-    df_swr1 = df_swr1[df_swr1['datetime'].isin(dt_index)].reset_index(drop=True)
-    df_swr2 = df_swr2[df_swr2['datetime'].isin(dt_index)].reset_index(drop=True)
-    df_swdir = df_swdir[df_swdir['datetime'].isin(dt_index)].reset_index(drop=True)
-    df_swdir2 = df_swdir2[df_swdir2['datetime'].isin(dt_index)].reset_index(drop=True)
-
-    # process for calculating D and determining modality
-    calc_D.calc_D(storm_dict, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2, station_id, f_type, start_date, end_date, save_is_storm)
-    print(f"Completed processing for buoy {station_id}.")
\ No newline at end of file
+# guard the run so process-pool workers can import this module safely
+if __name__ == "__main__":
+    # bring an existing database up to the current schema, then load the small reference tables once up front
+    ct.migrate()
+    rc.preload()
+
+    # realtime stations only ingest rows newer than their high-water mark
+    rt_stations = [str(station_id) for station_id, f_type in zip(file_station_id, file_type) if f_type in u.realtime_types]
+    marks = {}
+    if rt_stations:
+        with db.session() as s:
+            marks = q.get_ingest_marks(s.cur, rt_stations, 'noaa-rt')
+
+    # realtime api stations are fetched together up front, concurrently, stopping at each mark
+    api_stations = [station_id for station_id, f_type in zip(file_station_id, file_type) if f_type == 'noaa-api']
+    if api_stations:
+        from fetch_data.fetch_from_api import fetch_many_from_api
+        api_frames = fetch_many_from_api(api_stations, marks=marks)
+
+    for station_id, f_date, f_type, cdip_deployment in zip(file_station_id, file_date, file_type, cdip_deployments):
+        # source readers are imported per case so a NOAA run never loads xarray/cdsapi/netCDF4
+        match f_type:
+            case 'noaa-rt':
+                from fetch_data.fetch_from_rt import fetch_from_rt
+                df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2 = u.frames_after_mark(
+                    marks.get(str(station_id)), *fetch_from_rt(station_id, f_date))
+            case 'noaa-year':
+                from fetch_data.fetch_from_year import fetch_from_year
+                df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2, deployment_id = fetch_from_year(station_id, f_date)
+            case 'noaa-api':
+                if isinstance(api_frames[station_id], Exception):
+                    print(f"Skipping {station_id}: {api_frames[station_id]}")
+                    continue
+                if api_frames[station_id] is None:
+                    print(f"No new realtime rows for {station_id}.")
+                    continue
+                df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2 = api_frames[station_id]
+            case 'cdip':
+                from fetch_data.fetch_from_cdip import fetch_from_cdip
+                df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2, deployment_id = fetch_from_cdip(station_id, cdip_deployment)
+            case _:
+                raise ValueError(f"Unsupported file_type entry: {f_type}")
+
+        if df_txt.empty:
+            print(f"No new rows for {station_id}.")
+            continue
+
+        # realtime files carry no deployment, register one for this batch so tide and storm matching have a position
+        if f_type in u.realtime_types:
+            deployment_id = u.register_realtime_deployment(station_id, df_txt)
+
+        # perform calcs for bulk parameters at each timestep
+        df_txt = u.df_txt_calcs(df_txt, df_data_spec, df_swdir, df_swr1)
+        print("Bulk wave parameters calculated.")
+
+        # get ENSO index values for the timesteps
+        df_txt = u.get_enso_index(df_txt)
+        print("ENSO index values assigned to timesteps.")
+
+        # get tidal values for the timesteps
+        df_txt = u.get_tidal_data(df_txt, deployment_id)
+        print("Tidal values assigned to timesteps.")
+
+        # timestep load, storm matches and the unprocessed lookup share one pooled session
+        with db.session() as s:
+            # move processed timesteps to database
+            u.insert_time_steps(s.cur, df_txt, f_type)
+            s.commit()
+            print("Timesteps uploaded to database if no conflict.")
+
+            # perform storm analysis at each timestep
+            df_txt, storm_dict = sbm.storm_buoy_match(s.cur, None, df_txt, 400, deployment_id, mode=c.storm_match_mode)
+            print("Completed storm-buoy matches.")
+
+            # filter the timesteps to only unprocessed ones
+            # check for spectrum ingested flag across timesteps
+            unprocessed_timesteps = u.get_unprocessed_timesteps(s.cur, str(station_id))
+
+        if not unprocessed_timesteps:
+            u.update_ingest_mark(station_id, f_type, df_txt)
+            continue
+
+        flat = [row[0] for row in unprocessed_timesteps if row and row[0] is not None]
+        dt_index = pd.to_datetime(flat, utc=True)
+
+        # select timesteps from the current data where ingested flag isn't set to true
+        df_data_spec = df_data_spec[df_data_spec['datetime'].isin(dt_index)].reset_index(drop=True)
+        df_swr1 = df_swr1[df_swr1['datetime'].isin(dt_index)].reset_index(drop=True)
+        df_swr2 = df_swr2[df_swr2['datetime'].isin(dt_index)].reset_index(drop=True)
+        df_swdir = df_swdir[df_swdir['datetime'].isin(dt_index)].reset_index(drop=True)
+        df_swdir2 = df_swdir2[df_swdir2['datetime'].isin(dt_index)].reset_index(drop=True)
+
+        # process for calculating D and determining modality
+        id_map = u.time_step_id_map(unprocessed_timesteps)
+        calc_D.calc_D(storm_dict, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2, station_id, f_type, start_date, end_date, save_is_storm, id_map=id_map)
+        u.update_ingest_mark(station_id, f_type, df_txt)
+        print(f"Completed processing for buoy {station_id}.")
+        print(f"Reference cache: {rc.cache_stats()}")
+
+    # cold (parsed from the raw files) vs warm (parsed-data cache) loads for this run
+    stats = pc.cache_stats()
+    print(f"Parsed-data cache: {stats['cold']} cold loads in {stats['cold_seconds']:.2f}s, "
+          f"{stats['warm']} warm loads in {stats['warm_seconds']:.2f}s.")
+
+    # close the pooled connections
+    db.dispose()
@@ -1,79 +1,122 @@
+import asyncio
+import io
 import pandas as pd
+import requests
+from concurrent.futures import ThreadPoolExecutor
 import config.config as c
+import fetch_data.ndbc_parser as nd
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def fetch_from_api(station_id, date):
-    import processes.utils as u
-    ## if no local file is used, read from api 
-    # create the buoy filepath to request from
-    txt_buoy_file = f"https://www.ndbc.noaa.gov/data/realtime2/{station_id}.txt"
-    data_spec_buoy_file = f"https://www.ndbc.noaa.gov/data/realtime2/{station_id}.data_spec"
-    swdir_buoy_file = f"https://www.ndbc.noaa.gov/data/realtime2/{station_id}.swdir"
-    swr1_buoy_file = f"https://www.ndbc.noaa.gov/data/realtime2/{station_id}.swr1"
-    swdir2_buoy_file = f"https://www.ndbc.noaa.gov/data/realtime2/{station_id}.swdir2"
-    swr2_buoy_file = f"https://www.ndbc.noaa.gov/data/realtime2/{station_id}.swr2"
+# the six NDBC realtime2 files pulled per station
+rt_extensions = ['txt', 'data_spec', 'swdir', 'swdir2', 'swr1', 'swr2']
+
+def make_rt_session(pool_size):
+    # one pooled session shared by every request of a refresh, retried with backoff on 429/5xx
+    retry = Retry(total=c.rt_retries, backoff_factor=c.rt_backoff,
+                  status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",))
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
-    # load to dataframes
-    df_txt = pd.read_csv(txt_buoy_file, sep='\s+', skiprows=[1], na_values=["MM",'999.0'])
-    df_data_spec = pd.read_csv(data_spec_buoy_file, sep='\s+', skiprows=[0], na_values=["MM",'999.0'], header=None)
-    df_swdir = pd.read_csv(swdir_buoy_file, sep='\s+', skiprows=[0], na_values=["MM",'999.0'], header=None)
-    df_swr1 = pd.read_csv(swr1_buoy_file, sep='\s+', skiprows=[0], na_values=["MM",'999.0'], header=None)
-    df_swdir2 = pd.read_csv(swdir2_buoy_file, sep='\s+', skiprows=[0], na_values=["MM",'999.0'], header=None)
-    df_swr2 = pd.read_csv(swr2_buoy_file, sep='\s+', skiprows=[0], na_values=["MM",'999.0'], header=None)
+def truncate_at_mark(text, mark, header_rows):
+    # realtime2 files are newest-first: keep the header and the rows newer than mark (naive UTC),
+    # scanning stops at the first row at or before the mark. Returns (text, number of rows kept)
+    if mark is None:
+        return text, None
+    key = (mark.year, mark.month, mark.day, mark.hour, mark.minute)
+    pos = 0
+    for _ in range(header_rows):
+        pos = text.find('\n', pos) + 1
+    header_end = pos
+    n_rows = 0
+    while 0 < pos < len(text):
+        end = text.find('\n', pos)
+        end = len(text) if end < 0 else end
+        parts = text[pos:end].split(None, 5)
+        if len(parts) >= 5 and tuple(int(p) for p in parts[:5]) <= key:
+            break
+        n_rows += 1
+        pos = end + 1
+    return (text[:pos] if n_rows else text[:header_end]), n_rows
 
-    # build paths to save out the raw files in case they are needed again
-    txt_path = f"{c.noaa_rt_path}\\{datetime.today().strftime('%Y-%m-%d')}_rt_{station_id}.txt"
-    data_spec_path = f"{c.noaa_rt_path}\\{datetime.today().strftime('%Y-%m-%d')}_rt_{station_id}.data_spec"
-    swdir_path = f"{c.noaa_rt_path}\\{datetime.today().strftime('%Y-%m-%d')}_rt_{station_id}.swdir"
-    swdir2_path = f"{c.noaa_rt_patht}\\{datetime.today().strftime('%Y-%m-%d')}_rt_{station_id}.swdir2"
-    swr1_path = f"{c.noaa_rt_path}\\{datetime.today().strftime('%Y-%m-%d')}_rt_{station_id}.swr1"
-    swr2_path = f"{c.noaa_rt_path}\\{datetime.today().strftime('%Y-%m-%d')}_rt_{station_id}.swr2"
+def read_rt_text(ext, text):
+    # parse one realtime2 file from memory, the spectral files go through the NDBC parser
+    if ext == 'txt':
+        return pd.read_csv(io.StringIO(text), sep=r'\s+', skiprows=[1], na_values=["MM",'999.0'])
+    return nd.parse_spectral_text(text, c.noaa_freqs, 'realtime', has_sep_freq=(ext == 'data_spec'))
 
-    # save the "rt" files to csvs
-    df_txt.to_csv(txt_path)
-    df_data_spec.to_csv(data_spec_path)
-    df_swdir.to_csv(swdir_path)
-    df_swdir2.to_csv(swdir2_path)
-    df_swr1.to_csv(swr1_path)
-    df_swr2.to_csv(swr2_path)
+def save_rt_texts(station_id, texts):
+    # save the "rt" files as fetched, in the layout fetch_from_rt reads back
+    today = datetime.today().strftime('%Y-%m-%d')
+    for ext, text in texts.items():
+        with open(f"{c.noaa_rt_path}\\{today}_rt_{station_id}.{ext}", 'w') as f:
+            f.write(text)
+
+def shape_rt_frames(station_id, raw):
+    # parsed realtime2 files keyed by extension -> aligned (df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2)
+    import processes.utils as u
+    df_txt = u.datetime_dfs(raw['txt'], station_id)
+    return nd.aligned_frames(station_id, df_txt, raw)
 
-    df_list = [df_txt,df_data_spec,df_swdir,df_swr1,df_swdir2,df_swr2]
-    for df in df_list:
-            df = u.datetime_dfs(df,station_id)
+def frames_from_texts(station_id, texts, save_raw):
+    # save (optionally), parse and align the fetched texts of one station, blocking
+    if save_raw:
+        save_rt_texts(station_id, texts)
+    raw = {ext: read_rt_text(ext, text) for ext, text in texts.items()}
+    return shape_rt_frames(station_id, raw)
 
-    # remove frequency identifiers
-    df_data_spec.drop(range(7,98,2),axis='columns',inplace=True)        
-    df_swdir.drop(range(6,97,2),axis='columns',inplace=True)
-    df_swr1.drop(range(6,97,2),axis='columns',inplace=True)
-    df_swdir2.drop(range(6,97,2),axis='columns',inplace=True)
-    df_swr2.drop(range(6,97,2),axis='columns',inplace=True)
+async def _fetch_station(session, semaphore, executor, station_id, save_raw, mark):
+    # the six files of one station, each request waits for a slot in the shared semaphore
+    # and runs the blocking get on the fetch thread pool, as is the parsing so the event loop keeps
+    # serving the other stations. With a mark only the newer rows are parsed, and None comes back when there are none
+    loop = asyncio.get_running_loop()
 
-    # rename frequency columns with integers for simplicity
-    column_list = ['station_id','datetime','sep_freq'] + list(range(1,47))
-    df_data_spec = df_data_spec.set_axis(column_list,axis=1)
-    # repeat for the rest without sep_freq column
-    column_list = ['station_id','datetime'] + list(range(1,47))
-    df_swdir = df_swdir.set_axis(column_list,axis=1)
-    df_swdir2 = df_swdir2.set_axis(column_list,axis=1)
-    df_swr1 = df_swr1.set_axis(column_list,axis=1)
-    df_swr2 = df_swr2.set_axis(column_list,axis=1)
+    async def get(ext):
+        async with semaphore:
+            response = await loop.run_in_executor(
+                executor, lambda: session.get(f"{c.url}{station_id}.{ext}", timeout=c.rt_timeout))
+        response.raise_for_status()
+        return response.text
 
-    # remove unneeded timesteps from df_txt
-    df_txt = df_txt[df_txt['datetime'].isin(df_data_spec['datetime'])]
-    df_txt = df_txt.reset_index(drop=True)
+    texts = await asyncio.gather(*(get(ext) for ext in rt_extensions))
+    texts = dict(zip(rt_extensions, texts))
+    if mark is not None:
+        kept = {}
+        for ext in rt_extensions:
+            texts[ext], kept[ext] = truncate_at_mark(texts[ext], mark, 2 if ext == 'txt' else 1)
+        if kept['txt'] == 0 or kept['data_spec'] == 0:
+            return None
+    return await loop.run_in_executor(executor, frames_from_texts, station_id, texts, save_raw)
 
-    # remove unmatching timesteps from spec dataframes (no df_txt match)
-    df_data_spec = df_data_spec[df_data_spec['datetime'].isin(df_txt['datetime'])]
-    df_swdir = df_swdir[df_swdir['datetime'].isin(df_txt['datetime'])]
-    df_swdir2 = df_swdir2[df_swdir2['datetime'].isin(df_txt['datetime'])]
-    df_swr1 = df_swr1[df_swr1['datetime'].isin(df_txt['datetime'])]
-    df_swr2 = df_swr2[df_swr2['datetime'].isin(df_txt['datetime'])]
+async def _fetch_stations(station_ids, max_concurrency, save_raw, marks):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    session = make_rt_session(max_concurrency)
+    # sized to the semaphore, the default executor is capped by cpu count
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    try:
+        results = await asyncio.gather(*(_fetch_station(session, semaphore, executor, station_id, save_raw, marks.get(str(station_id)))
+                                         for station_id in station_ids),
+                                       return_exceptions=True)
+    finally:
+        executor.shutdown(wait=False)
+        session.close()
+    return dict(zip(station_ids, results))
 
-    # reset the index
-    df_data_spec = df_data_spec.reset_index(drop=True)
-    df_swdir = df_swdir.reset_index(drop=True)
-    df_swdir2 = df_swdir2.reset_index(drop=True)
-    df_swr1 = df_swr1.reset_index(drop=True)
-    df_swr2 = df_swr2.reset_index(drop=True)
+def fetch_many_from_api(station_ids, max_concurrency=None, save_raw=None, marks=None):
+    # {station_id: frames tuple} for every station, fetched concurrently over one pooled session.
+    # A station whose files are missing (e.g. no spectral data) maps to the exception instead.
+    # marks ({station_id: last ingested timestamp}) limits each station to newer rows, None if nothing is new
+    max_concurrency = max_concurrency or c.rt_max_concurrency
+    save_raw = c.rt_save_raw if save_raw is None else save_raw
+    return asyncio.run(_fetch_stations(list(station_ids), max_concurrency, save_raw, marks or {}))
 
-    return df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2
\ No newline at end of file
+def fetch_from_api(station_id, date, save_raw=None, mark=None):
+    ## if no local file is used, read from api
+    result = fetch_many_from_api([station_id], save_raw=save_raw, marks={str(station_id): mark})[station_id]
+    if isinstance(result, Exception):
+        raise result
+    return result
@@ -8,8 +8,10 @@ from dateutil.rrule import rrule, MONTHLY
 from scipy.interpolate import interp1d
 
 # modules
+import data.db as db
 import data.query as q
 import config.config as c
+import fetch_data.parsed_cache as pc
 from fetch_data.fetch_from_era5 import fetch_from_era5
 
 def fetch_cdip_file(station_id: int, deployment: int, cdip_output_file: str = None) -> xr.Dataset | None:
@@ -43,9 +45,8 @@ def fetch_cdip_file(station_id: int, deployment: int, cdip_output_file: str = No
             print(f"[CDIP FETCH ERROR] Station {station_id}, deployment {deployment}: {e}")
             return None
 
-def fetch_from_cdip(station_id: int, deployment: int) -> xr.Dataset | None:   
-    # set local location for the raw data
-    cdip_output_file= rf"{c.cdip_path}\{station_id}\cdip_{station_id}_d{deployment:02d}.nc"
+def parse_cdip(station_id: int, deployment: int, cdip_output_file: str):
+    # frames on the NOAA bins plus the files they came from and the deployment metadata, None if the fetch fails
 
     # attempt to fetch from local and pull from THREDDS if not found
     ds = fetch_cdip_file(station_id, deployment, cdip_output_file)
@@ -74,12 +75,14 @@ def fetch_from_cdip(station_id: int, deployment: int) -> xr.Dataset | None:
         date_ranges = list(rrule(freq=MONTHLY, dtstart=era5_start_time, until=era5_end_time))
 
         df_met_list = []
+        era5_files = []
         for start_month in date_ranges:
             start = datetime(year=start_month.year, month = start_month.month, day = 1)
 
             era5_output_file = f"D:/Buoy_work/Raws Storage/ERA5 Raws/{station_id}/era5_{station_id}_{start:%Y%m}.nc"
             era5_zip_output_file = f"D:/Buoy_work/Raws Storage/ERA5 Raws/{station_id}/zips/era5_{station_id}_{start:%Y%m}.zip"
             met_df_month = fetch_from_era5(station_id, start, lat, lon, era5_output_file, era5_zip_output_file)
+            era5_files.append(era5_output_file)
             df_met_list.append(met_df_month)
 
         # concatenate all the monthly api pulls
@@ -190,12 +193,6 @@ def fetch_from_cdip(station_id: int, deployment: int) -> xr.Dataset | None:
         alpha1 = np.where(~np.isnan(alpha1), u.math_to_met_dir(alpha1), np.nan)
         alpha2 = np.where(~np.isnan(alpha2), u.math_to_met_dir(alpha2), np.nan)'''
 
-        meta_buoy = {
-            'station_id': station_id,
-            'name': name_str,
-            'project': project
-        }
-        
         df_txt_buoy = pd.DataFrame({
             'station_id': station_id,
             'datetime': timestamp,
@@ -248,29 +245,48 @@ def fetch_from_cdip(station_id: int, deployment: int) -> xr.Dataset | None:
         df_swr2.insert(0, 'station_id', station_id)
         df_swr2['datetime'] = pd.to_datetime(df_swr2['datetime']).dt.tz_localize('UTC')
 
-        df_txt = df_txt.where(pd.notnull(df_txt), None)
-
-        # save buoy metadata to buoys table
-        cur = c.conn.cursor()
-        q.insert_buoy(cur, meta_buoy)
-        c.conn.commit()
-
-        # save to buoy deployments table
-        buoy_id = q.get_buoy_id(str(station_id))
-        buoy_id = buoy_id.loc[0,'id']
-        deployment_id = deployment
-        buoy_deploy = {
-            'buoy_id': buoy_id,
-            'deployment_id': deployment_id,
-            'start_time': df_txt['datetime'].min(),
-            'end_time': df_txt['datetime'].max(),
-            'latitude': lat,
-            'longitude': lon,
-            'deployment_type': 'CDIP',
-            'depth': float(depth)
-        }
-
-        q.insert_deployment(cur, buoy_deploy)
-        c.conn.commit()
-
-        return df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2, deployment_id
+        frames = (df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2)
+        sources = [cdip_output_file] + [f for f in era5_files if os.path.exists(f)]
+        meta = {'name': name_str, 'project': project, 'lat': float(lat), 'lon': float(lon), 'depth': float(depth)}
+        return frames, sources, meta
+
+def fetch_from_cdip(station_id: int, deployment: int):
+    # set local location for the raw data
+    cdip_output_file= rf"{c.cdip_path}\{station_id}\cdip_{station_id}_d{deployment:02d}.nc"
+
+    # attempt the parsed-data cache, then local and pull from THREDDS if not found
+    result = pc.cached_frames('cdip', f"{station_id}_d{deployment:02d}", lambda: parse_cdip(station_id, deployment, cdip_output_file))
+    if result is None:
+        return None
+    (df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2), meta = result
+
+    df_txt = df_txt.where(pd.notnull(df_txt), None)
+
+    # save buoy metadata to buoys table
+    meta_buoy = {
+        'station_id': station_id,
+        'name': meta['name'],
+        'project': meta['project']
+    }
+    with db.session() as s:
+        q.insert_buoy(s.cur, meta_buoy)
+
+    # save to buoy deployments table
+    buoy_id = q.get_buoy_id(str(station_id))
+    buoy_id = buoy_id.loc[0,'id']
+    deployment_id = deployment
+    buoy_deploy = {
+        'buoy_id': buoy_id,
+        'deployment_id': deployment_id,
+        'start_time': df_txt['datetime'].min(),
+        'end_time': df_txt['datetime'].max(),
+        'latitude': meta['lat'],
+        'longitude': meta['lon'],
+        'deployment_type': 'CDIP',
+        'depth': meta['depth']
+    }
+
+    with db.session() as s:
+        q.insert_deployment(s.cur, buoy_deploy)
+
+    return df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2, deployment_id
@@ -1,9 +1,32 @@
 import pandas as pd
 import config.config as c
 import processes.utils as u
+import fetch_data.parsed_cache as pc
 
 def fetch_from_rt(station_id, date):
-    # look for local "realtime" files
+    # look for local "realtime" files: raw realtime2 text as saved by fetch_from_api,
+    # or the older csv dumps of the pandas frames. Served from the parsed-data cache until the files change
+    from fetch_data.fetch_from_api import rt_extensions
+    path = f"{c.noaa_rt_path}\\{date}_rt_{station_id}"
+
+    def parse():
+        with open(f"{path}.data_spec", 'r') as f:
+            raw_text = f.readline().startswith('#')
+        if raw_text:
+            from fetch_data.fetch_from_api import read_rt_text, shape_rt_frames
+            raw = {}
+            for ext in rt_extensions:
+                with open(f"{path}.{ext}", 'r') as f:
+                    raw[ext] = read_rt_text(ext, f.read())
+            frames = shape_rt_frames(station_id, raw)
+        else:
+            frames = fetch_from_rt_csv(station_id, date)
+        return frames, [f"{path}.{ext}" for ext in rt_extensions], None
+
+    frames, _ = pc.cached_frames('noaa-rt', f"{station_id}_{date}", parse)
+    return frames
+
+def fetch_from_rt_csv(station_id, date):
     df_txt = pd.read_csv(f"{c.noaa_rt_path}\\{date}_rt_{station_id}.txt",index_col=0)
     df_data_spec = pd.read_csv(f"{c.noaa_rt_path}\\{date}_rt_{station_id}.data_spec",index_col=0)
     df_swdir = pd.read_csv(f"{c.noaa_rt_path}\\{date}_rt_{station_id}.swdir",index_col=0)
@@ -0,0 +1,128 @@
+import io
+import numpy as np
+import pandas as pd
+
+# parser for the NDBC spectral files (.data_spec, .swdir, .swdir2, .swr1, .swr2), straight to
+# float32 arrays and a datetime64 index. Two layouts:
+#   'realtime' (realtime2): YY MM DD hh mm [sep_freq] value (freq) value (freq) ..., frequencies inline
+#   'year' (historical):    YY MM DD hh mm value value ..., frequencies in the header line
+# Columns are matched to config.noaa_freqs (extra bins such as .0200 are dropped), MM and the
+# numeric sentinels become NaN
+
+spectral_extensions = ('data_spec', 'swdir', 'swdir2', 'swr1', 'swr2')
+
+# numeric missing-value sentinel in the spectral files, for both layouts. 99 is a stdmet marker only,
+# in .swdir/.swdir2 it is a valid direction
+sentinels = (999.0,)
+
+# a file frequency matches a config frequency within this (Hz), well under the 0.005 Hz bin step
+freq_tolerance = 0.002
+
+def _split_header(text):
+    # header lines start with '#' or a non-numeric token, returns (header lines, data text)
+    lines = []
+    pos = 0
+    while pos < len(text):
+        end = text.find('\n', pos)
+        end = len(text) if end < 0 else end
+        line = text[pos:end]
+        first = line.split(None, 1)[0] if line.strip() else ''
+        if first and first.isdigit():
+            break
+        if first:
+            lines.append(line)
+        pos = end + 1
+    return lines, text[pos:]
+
+def match_freqs(file_freqs, freqs):
+    # column position in the file for each config frequency, ValueError when a band is missing
+    file_freqs = np.asarray(file_freqs, dtype=float)
+    freqs = np.asarray(freqs, dtype=float)
+    nearest = np.abs(file_freqs[None, :] - freqs[:, None]).argmin(axis=1)
+    off = np.abs(file_freqs[nearest] - freqs) > freq_tolerance
+    if off.any():
+        raise ValueError(f"NDBC frequency bands {freqs[off].round(4).tolist()} not found in file frequencies")
+    return nearest
+
+def datetimes_from_fields(fields):
+    # (N, 5) year, month, day, hour, minute -> datetime64[ns] without going through strings
+    fields = fields.astype(np.int64)
+    year = np.where(fields[:, 0] < 100, fields[:, 0] + 1900, fields[:, 0])
+    months = (year - 1970) * 12 + fields[:, 1] - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (fields[:, 2] - 1)
+    minutes = days.astype('datetime64[m]') + fields[:, 3] * 60 + fields[:, 4]
+    return minutes.astype('datetime64[ns]')
+
+def parse_spectral_text(text, freqs, layout='realtime', has_sep_freq=False):
+    # returns {'datetime': datetime64[ns] (T,), 'values': float32 (T, F), 'sep_freq': float32 (T,) or None}
+    # rows keep the file order, F follows freqs
+    header, body = _split_header(text)
+    n_lead = 5 + (1 if has_sep_freq else 0)
+    if not body.strip():
+        return {'datetime': np.array([], dtype='datetime64[ns]'), 'values': np.empty((0, len(freqs)), dtype=np.float32),
+                'sep_freq': np.empty(0, dtype=np.float32) if has_sep_freq else None}
+
+    if layout == 'realtime':
+        # frequencies come inline as "(0.033)" after each value, read them off the first row
+        first_row = body[:body.find('\n')] if '\n' in body else body
+        tokens = first_row.split()
+        file_freqs = [float(tok.strip('()')) for tok in tokens[n_lead + 1::2]]
+        value_cols = np.arange(n_lead, n_lead + 2 * len(file_freqs), 2)
+    elif layout == 'year':
+        tokens = header[0].split() if header else []
+        file_freqs = [float(tok) for tok in tokens[n_lead:]]
+        value_cols = np.arange(n_lead, n_lead + len(file_freqs))
+    else:
+        raise ValueError(f"Unknown NDBC layout: {layout}")
+
+    value_cols = value_cols[match_freqs(file_freqs, freqs)]
+
+    # only the date, sep_freq and value columns are converted, the inline "(freq)" tokens are skipped
+    usecols = list(range(n_lead)) + value_cols.tolist()
+    data = np.loadtxt(io.StringIO(body.replace('MM', 'nan')), usecols=usecols, dtype=np.float64, ndmin=2)
+
+    values = data[:, n_lead:].astype(np.float32)
+    values[np.isin(values, np.array(sentinels, dtype=np.float32))] = np.nan
+    sep_freq = None
+    if has_sep_freq:
+        sep_freq = data[:, 5].astype(np.float32)
+        sep_freq[np.isin(sep_freq, np.array(sentinels, dtype=np.float32))] = np.nan
+    return {'datetime': datetimes_from_fields(data[:, :5]), 'values': values, 'sep_freq': sep_freq}
+
+def spectral_frame(station_id, parsed, rows=None):
+    # pipeline layout: station_id, datetime (UTC), [sep_freq], 1..F
+    rows = slice(None) if rows is None else rows
+    values = parsed['values'][rows]
+    df = pd.DataFrame(values, columns=list(range(1, values.shape[1] + 1)))
+    if parsed['sep_freq'] is not None:
+        df.insert(0, 'sep_freq', parsed['sep_freq'][rows])
+    df.insert(0, 'datetime', pd.DatetimeIndex(parsed['datetime'][rows]).tz_localize('UTC'))
+    df.insert(0, 'station_id', station_id)
+    return df
+
+def aligned_frames(station_id, df_txt, parsed):
+    # df_txt plus the five spectral frames restricted to the timesteps present in all six,
+    # in data_spec order. parsed is keyed by extension, df_txt already has its datetime column.
+    # A timestamp repeated within a file keeps its first row, so every frame has one row per timestep
+    rows = {}
+    indexes = {}
+    for ext in spectral_extensions:
+        index = pd.DatetimeIndex(parsed[ext]['datetime']).tz_localize('UTC')
+        first = ~index.duplicated()
+        rows[ext] = np.flatnonzero(first)
+        indexes[ext] = index[first]
+    txt_index = pd.DatetimeIndex(df_txt['datetime'])
+    txt_rows = np.flatnonzero(~txt_index.duplicated())
+    txt_index = txt_index[txt_rows]
+
+    common = indexes['data_spec']
+    for ext in spectral_extensions[1:]:
+        common = common[common.isin(indexes[ext])]
+    common = common[common.isin(txt_index)]
+
+    frames = {}
+    for ext in spectral_extensions:
+        frames[ext] = spectral_frame(station_id, parsed[ext], rows[ext][indexes[ext].get_indexer(common)])
+
+    df_txt = df_txt.iloc[txt_rows[txt_index.get_indexer(common)]].reset_index(drop=True)
+    return df_txt, frames['data_spec'], frames['swdir'], frames['swdir2'], frames['swr1'], frames['swr2']
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+
+# modules
+import config.config as c
+
+# columnar cache of parsed raw buoy files: the frames a fetch_from_* reader builds are saved under
+# cache_path/parsed/<kind>/<name>/ as one .npy per column (memory-mapped on load) plus meta.json.
+# An entry is valid while every source file it was built from keeps its mtime and size and the
+# config frequencies are unchanged; anything else rebuilds it from the raw files
+cache_version = 1
+
+_stats = {'warm': 0, 'cold': 0, 'warm_seconds': 0.0, 'cold_seconds': 0.0}
+
+def entry_dir(kind, name):
+    return os.path.join(c.cache_path, 'parsed', kind, str(name))
+
+def source_signature(paths):
+    # [path, mtime_ns, size] per source file
+    signature = []
+    for path in paths:
+        st = os.stat(path)
+        signature.append([os.path.abspath(path), st.st_mtime_ns, st.st_size])
+    return signature
+
+def freqs_digest():
+    return hashlib.sha1(np.asarray(c.noaa_freqs, dtype=np.float64).tobytes()).hexdigest()
+
+def _label(label):
+    # json keeps the int/float/str difference between column labels (1, 0.0325, 'WVHT')
+    if isinstance(label, np.integer):
+        return int(label)
+    if isinstance(label, np.floating):
+        return float(label)
+    return label
+
+def _is_valid(meta):
+    if meta.get('version') != cache_version or meta.get('freqs') != freqs_digest():
+        return False
+    for path, mtime_ns, size in meta['sources']:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if st.st_mtime_ns != mtime_ns or st.st_size != size:
+            return False
+    return True
+
+def load_frames(kind, name):
+    # (frames tuple, extra dict) or None when there is no valid entry
+    folder = entry_dir(kind, name)
+    meta_file = os.path.join(folder, 'meta.json')
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file, 'r') as f:
+        meta = json.load(f)
+    if not _is_valid(meta):
+        return None
+
+    frames = []
+    for i, spec in enumerate(meta['frames']):
+        data = {}
+        for j, col in enumerate(spec['columns']):
+            if col['kind'] == 'const':
+                data[j] = col['value']
+                continue
+            path = os.path.join(folder, f"{i}_{j}.npy")
+            if col['kind'] == 'object':
+                values = np.load(path, allow_pickle=True)
+            else:
+                values = np.load(path, mmap_mode='r')
+            if col['kind'] == 'datetime':
+                # stored as UTC ticks in the column's own unit
+                values = pd.DatetimeIndex(values.view(f"datetime64[{col['unit']}]"))
+                values = values.tz_localize('UTC').tz_convert(col['tz']) if col['tz'] else values
+            data[j] = values
+        df = pd.DataFrame(data, index=pd.RangeIndex(spec['rows']))
+        df.columns = [col['label'] for col in spec['columns']]
+        frames.append(df)
+    return tuple(frames), meta['extra']
+
+def save_frames(kind, name, frames, sources, extra=None):
+    # arrays first, meta.json last, so a half-written entry is never picked up
+    folder = entry_dir(kind, name)
+    os.makedirs(folder, exist_ok=True)
+    meta_file = os.path.join(folder, 'meta.json')
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+
+    specs = []
+    for i, df in enumerate(frames):
+        columns = []
+        for j, label in enumerate(df.columns):
+            series = df.iloc[:, j]
+            col = {'label': _label(label)}
+            if isinstance(series.dtype, pd.DatetimeTZDtype) or pd.api.types.is_datetime64_dtype(series.dtype):
+                col['kind'] = 'datetime'
+                col['tz'] = str(series.dt.tz) if series.dt.tz is not None else None
+                col['unit'] = series.dt.unit
+                values = pd.DatetimeIndex(series).asi8
+            elif not pd.api.types.is_numeric_dtype(series.dtype) and len(series) \
+                    and isinstance(series.iloc[0], (str, int, float)) and series.nunique(dropna=False) == 1:
+                # e.g. the station_id column, one value repeated on every row
+                col['kind'] = 'const'
+                col['value'] = _label(series.iloc[0])
+                columns.append(col)
+                continue
+            elif not pd.api.types.is_numeric_dtype(series.dtype):
+                col['kind'] = 'object'
+                values = series.to_numpy(dtype=object)
+            else:
+                col['kind'] = 'array'
+                values = series.to_numpy()
+            np.save(os.path.join(folder, f"{i}_{j}.npy"), values, allow_pickle=(col['kind'] == 'object'))
+            columns.append(col)
+        specs.append({'rows': len(df), 'columns': columns})
+
+    meta = {'version': cache_version, 'freqs': freqs_digest(), 'sources': source_signature(sources),
+            'frames': specs, 'extra': extra or {}}
+    tmp_file = f"{meta_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_file, meta_file)
+
+def cached_frames(kind, name, build):
+    # build() -> (frames tuple, source paths, extra dict), only called on a miss. Returns (frames, extra),
+    # or None when build has nothing (e.g. a failed download)
+    start = time.perf_counter()
+    if c.parsed_cache:
+        cached = load_frames(kind, name)
+        if cached is not None:
+            elapsed = time.perf_counter() - start
+            _stats['warm'] += 1
+            _stats['warm_seconds'] += elapsed
+            print(f"Loaded {kind} {name} from the parsed cache in {elapsed:.2f}s.")
+            return cached
+
+    result = build()
+    if result is None:
+        return None
+    frames, sources, extra = result
+    if c.parsed_cache:
+        save_frames(kind, name, frames, sources, extra)
+    elapsed = time.perf_counter() - start
+    _stats['cold'] += 1
+    _stats['cold_seconds'] += elapsed
+    print(f"Parsed {kind} {name} from the raw files in {elapsed:.2f}s.")
+    return frames, extra or {}
+
+def cache_stats():
+    return dict(_stats)
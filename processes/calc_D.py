@@ -1,136 +1,217 @@
-def calc_D(storm_dict, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2, station_id, f_type, start_date, end_date, save_is_storm):
-    import sys
-    import pandas as pd
-    import psycopg2
-    import numpy as np
+import sys
+import numpy as np
+from functools import lru_cache
+import pandas as pd
 
+def spec_arrays(df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2, f_type):
     # modules
     import processes.utils as u
-    import config.config as c
-    import processes.detect_modality as dm
 
-    # loops through each timestep where spec_ingested = False
-    for i,spec_row in df_data_spec.iterrows():
-        # get the timestep row for all tables needed
-        swdir_row = df_swdir.iloc[i,:]
-        swdir2_row = df_swdir2.iloc[i,:]
-        swr1_row = df_swr1.iloc[i,:]
-        swr2_row = df_swr2.iloc[i,:]
-
-        # check that all rows have the timestep
-        datetime_obj = spec_row['datetime']
-        if all(datetime_obj == row['datetime'] for row in [swdir_row, swdir2_row, swr1_row, swr2_row]):
-            pass
-        else:
+    # check that all tables have the same timesteps in the same order
+    datetimes = pd.DatetimeIndex(df_data_spec['datetime'])
+    for df in [df_swdir, df_swdir2, df_swr1, df_swr2]:
+        if not datetimes.equals(pd.DatetimeIndex(df['datetime'])):
             print('Datetime mismatch')
             sys.exit()
-        
-        if f_type == 'noaa-rt' or f_type == 'noaa-api':
-            # drop the unneeded rows for calculations
-            spec_row = spec_row.iloc[3:]
-        else:
-            spec_row = spec_row.iloc[2:]
-        swdir_row = swdir_row.iloc[2:]
-        swdir2_row = swdir2_row.iloc[2:]
-        swr1_row = swr1_row.iloc[2:]
-        swr2_row = swr2_row.iloc[2:]
-
-        # prepare for vectorized calculation
-        # alpha assumed as met in degrees
-        alpha1 = pd.to_numeric(swdir_row, errors='coerce')
-        alpha1 = np.where(~np.isnan(alpha1), u.met_to_math_dir(alpha1), np.nan)
-        alpha1 = alpha1.astype(float)
-        alpha2 = pd.to_numeric(swdir2_row, errors='coerce')
-        alpha2 = np.where(~np.isnan(alpha2), u.met_to_math_dir(alpha2), np.nan)
-        alpha2 = alpha2.astype(float)
-
-        r1 = pd.to_numeric(swr1_row,errors='coerce')
-        r1 = np.array(r1)
-        r2 = pd.to_numeric(swr2_row, errors='coerce')
-        r2 = np.array(r2)
-
-        Ef = pd.to_numeric(spec_row, errors='coerce')
-        Ef = np.array(Ef)
-
-        alpha1_grid = alpha1[:,None]
-        alpha2_grid = alpha2[:, None]
-        E = Ef[:, None]
-
-        D = (1 / (2 * np.pi)) * (
-            (1 + 2 * r1[:, None] * np.cos(c.theta_grid - alpha1_grid))
-            + (2 * r2[:, None] * np.cos(2 * (c.theta_grid - alpha2_grid))
-            ))
-        
-        # remove negatives from D output
-        D = np.maximum(D, 0)
-        
-        row_sums = np.sum(D, axis=1, keepdims=True) * c.delta_theta_rad
+
+    # drop the unneeded columns for calculations
+    if f_type == 'noaa-rt' or f_type == 'noaa-api':
+        spec_vals = df_data_spec.iloc[:, 3:]
+    else:
+        spec_vals = df_data_spec.iloc[:, 2:]
+
+    def to_array(df):
+        return df.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+
+    Ef = to_array(spec_vals)
+    r1 = to_array(df_swr1.iloc[:, 2:])
+    r2 = to_array(df_swr2.iloc[:, 2:])
+
+    # alpha assumed as met in degrees, converted to math radians
+    alpha1 = to_array(df_swdir.iloc[:, 2:])
+    alpha1 = np.where(~np.isnan(alpha1), u.met_to_math_dir(alpha1), np.nan)
+    alpha2 = to_array(df_swdir2.iloc[:, 2:])
+    alpha2 = np.where(~np.isnan(alpha2), u.met_to_math_dir(alpha2), np.nan)
+
+    return datetimes, Ef, alpha1, alpha2, r1, r2
+
+@lru_cache(maxsize=None)
+def fourier_basis(resolution_deg):
+    # cached direction grid and [1, cos, sin, cos2, sin2](theta) basis for a directional resolution
+    if 360 % resolution_deg != 0:
+        raise ValueError(f"Directional resolution must divide 360 degrees: {resolution_deg}")
+    directions_deg = np.arange(0, 360, resolution_deg)
+    theta = np.deg2rad(directions_deg)
+    basis = np.stack([np.ones_like(theta), np.cos(theta), np.sin(theta), np.cos(2 * theta), np.sin(2 * theta)])
+    basis.setflags(write=False)
+    return directions_deg, basis
+
+def fourier_coeffs(alpha1, alpha2, r1, r2):
+    # (T, F, 5) coefficients matching fourier_basis, alpha in math radians
+    return np.stack([
+        np.ones_like(r1),
+        2 * r1 * np.cos(alpha1),
+        2 * r1 * np.sin(alpha1),
+        2 * r2 * np.cos(2 * alpha2),
+        2 * r2 * np.sin(2 * alpha2),
+    ], axis=-1)
+
+def spreading(alpha1, alpha2, r1, r2, resolution_deg=5):
+    # D = (1 + 2 r1 cos(theta - a1) + 2 r2 cos(2(theta - a2))) / 2pi on the cached basis, negatives removed,
+    # before normalisation. Inputs of any matching shape, output gains a trailing direction axis
+    _, basis = fourier_basis(resolution_deg)
+    return np.maximum((fourier_coeffs(alpha1, alpha2, r1, r2) @ basis) / (2 * np.pi), 0)
+
+def compute_D(Ef, alpha1, alpha2, r1, r2, resolution_deg=5, chunk_size=1024):
+    # vectorized D(f, theta) and S(f, theta) for a (T, F) stack of timesteps
+    directions_deg, _ = fourier_basis(resolution_deg)
+    delta_theta_rad = np.deg2rad(resolution_deg)
+    n_t, n_f = Ef.shape
+    n_dirs = len(directions_deg)
+    D_normalized = np.empty((n_t, n_f, n_dirs))
+    S = np.empty((n_t, n_f, n_dirs))
+
+    for start in range(0, n_t, chunk_size):
+        stop = min(start + chunk_size, n_t)
+        D = spreading(alpha1[start:stop], alpha2[start:stop], r1[start:stop], r2[start:stop], resolution_deg)
+
+        row_sums = np.sum(D, axis=2, keepdims=True) * delta_theta_rad
         row_sums[row_sums == 0] = 1
         # normalize
-        D_normalized = D / row_sums
-
-        S = D_normalized * E
-
-        # get the timestep id from the timesteps table
-        timestep_id = u.get_time_step_id(c.cur, str(station_id), datetime_obj)
-
-        # organize for exporting to postgres table
-        records_param = []
-        records_dir = []
-        for m, f in enumerate(c.noaa_freqs):
-            a_1 = float(u.math_to_met_dir(alpha1[m])) if not np.isnan(alpha1[m]) else None
-            a_2 = float(u.math_to_met_dir(alpha2[m])) if not np.isnan(alpha2[m]) else None
-            r_1 = float(r1[m]) if not np.isnan(r1[m]) else None
-            r_2 = float(r2[m]) if not np.isnan(r2[m]) else None
-            energy_density = float(E[m, 0])
-            records_param.append((int(timestep_id), float(f), a_1, a_2, r_1, r_2, float(energy_density)))
-
-        # write the spectral data to the spec table
-        spectra_parameters_insert_query = """
-            INSERT INTO dirspec.spectra_parameters (time_step_id, frequency, alpha1, alpha2, r1, r2, energy_density)
-            VALUES %s
-            ON CONFLICT (time_step_id, frequency) DO NOTHING
-        """
-        psycopg2.extras.execute_values(c.cur, spectra_parameters_insert_query, records_param, page_size=100)
-
-        for m, f in enumerate(c.noaa_freqs):
-            for n, theta in enumerate(c.directional_pnts_deg):
-                spreading = float(D_normalized[m, n])
-                records_dir.append((timestep_id, f, theta, spreading))
-
-        records_dir = [(int(timestep_id), float(f), int(theta), float(spreading)) for (timestep_id, f, theta, spreading) in records_dir]
-
-        # determine modality and record for each timestep
-        modality_res = dm.detect_modality_from_dmatrix(S)
-
-        in_date_range = (start_date <= datetime_obj <= end_date)
-        is_storm_case = save_is_storm and timestep_id in storm_dict
-
-        if in_date_range or is_storm_case:
-            direction_insert_query = """
-                INSERT INTO dirspec.spectra_directional (
-                    time_step_id, frequency, direction, spreading
-                ) VALUES %s
-                ON CONFLICT (time_step_id, frequency, direction) DO NOTHING
-            """
-            psycopg2.extras.execute_values(c.cur, direction_insert_query, records_dir, page_size=500)
-
-            c.conn.commit()
-
-            c.cur.execute("""
-                UPDATE dirspec.time_steps
-                SET modality_boot = %s,     
-                    spectra_ingested = TRUE
-                WHERE id = %s
-            """, (modality_res, timestep_id,))
-            c.conn.commit()
-
+        D_normalized[start:stop] = D / row_sums
+        S[start:stop] = D_normalized[start:stop] * Ef[start:stop, :, None]
+
+    return D_normalized, S
+
+def modality_sigma(resolution_deg):
+    # detect_modality smooths over 2 bins at 5 degrees, scaled so the smoothing covers the same angle at any resolution
+    return 2 * 5 / resolution_deg
+
+def make_grid(freqs, resolution_deg):
+    # frequency/direction grids used by the spreading calculation and the writers
+    directions_deg, _ = fourier_basis(resolution_deg)
+    return {
+        'freqs': np.asarray(freqs, dtype=float),
+        'directions_deg': directions_deg,
+        'resolution_deg': resolution_deg,
+    }
+
+def process_chunk(s, grid, timestep_ids, save_mask, Ef, alpha1, alpha2, r1, r2, alpha1_met, alpha2_met, options):
+    # compute, classify and write one chunk of timesteps on the given db.session, which owns the transaction
+    # kept free of config so that it can run in a worker process
+    import processes.detect_modality as dm
+    import processes.modality_bootstrap as mb
+    import data.copy_writer as cw
+
+    # calculate the spreading and energy for the whole chunk at once
+    D_chunk, S_chunk = compute_D(Ef, alpha1, alpha2, r1, r2, grid['resolution_deg'], len(Ef))
+
+    # determine modality for each timestep
+    modality_res = dm.detect_modality_batch(S_chunk, direction_smoothing=modality_sigma(grid['resolution_deg']))
+
+    # bootstrap confidence, seeded from the chunk so serial and parallel runs agree
+    modality_conf = modality_ver = None
+    if options['boot_replicates']:
+        modality_conf = mb.bootstrap_modality(Ef, alpha1, alpha2, r1, r2, modality_res,
+                                              n_replicates=options['boot_replicates'], dof=options['boot_dof'],
+                                              resolution_deg=grid['resolution_deg'],
+                                              seed=[options['boot_seed'], int(timestep_ids[0])])
+        modality_ver = f"{mb.MODALITY_VER}-n{options['boot_replicates']}-dof{options['boot_dof']}"
+
+    # write the whole batch in one transaction, a failure only loses this batch
+    # and the timesteps come back through get_unprocessed_timesteps on the next run
+    cur = s.cur
+    try:
+        if options['storage'] == 'packed':
+            cw.copy_spectra_packed(cur, timestep_ids, Ef, alpha1_met, alpha2_met, r1, r2,
+                                   D=D_chunk if options['packed_store_D'] else None, keep_D=save_mask)
         else:
-            c.cur.execute("""
-                UPDATE dirspec.time_steps
-                SET modality_boot = %s,     
-                    spectra_ingested = FALSE
-                WHERE id = %s
-            """, (modality_res, timestep_id,))
-            c.conn.commit()
-            
+            cw.copy_spectra_parameters(cur, timestep_ids, grid['freqs'], Ef, alpha1_met, alpha2_met, r1, r2)
+            cw.copy_spectra_directional(cur, timestep_ids[save_mask], grid['freqs'], grid['directions_deg'], D_chunk[save_mask])
+
+        # modality and ingested flags for the batch in one statement
+        cw.update_time_step_status(cur, timestep_ids, modality_res, save_mask, modality_conf, modality_ver)
+        s.commit()
+    except Exception:
+        s.rollback()
+        raise
+
+    return modality_res
+
+# per-process state for parallel workers
+_worker = {}
+
+def _init_worker(freqs, resolution_deg):
+    # each worker drops the parent's pool, opens its own on first use and builds the grids once
+    import data.db as db
+    db.init_worker()
+    _worker['grid'] = make_grid(freqs, resolution_deg)
+
+def _run_chunk(args):
+    import data.db as db
+    with db.session(commit=False) as s:
+        return process_chunk(s, _worker['grid'], *args)
+
+def calc_D(storm_dict, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2, station_id, f_type, start_date, end_date, save_is_storm, chunk_size=None, storage=None, id_map=None, n_workers=None, resolution_deg=None):
+    from concurrent.futures import ProcessPoolExecutor
+
+    # modules
+    import processes.utils as u
+    import config.config as c
+    import data.db as db
+
+    storage = storage or c.spectra_storage
+    chunk_size = chunk_size or c.commit_batch_size
+    n_workers = n_workers or c.n_workers
+    resolution_deg = resolution_deg or c.direction_resolution_deg
+
+    # pull the aligned arrays for all timesteps where spec_ingested = False
+    datetimes, Ef, alpha1, alpha2, r1, r2 = spec_arrays(df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2, f_type)
+    if len(datetimes) == 0:
+        return
+
+    # resolve every timestep id up front, from the caller's map if it already has one
+    if id_map is None:
+        with db.session() as s:
+            id_map = u.get_time_step_id_map(s.cur, str(station_id), datetimes.min(), datetimes.max())
+    timestep_ids = u.align_time_step_ids(id_map, datetimes)
+    if (timestep_ids < 0).any():
+        print(f"{int((timestep_ids < 0).sum())} timesteps have no time_steps row and were skipped.")
+        keep = timestep_ids >= 0
+        datetimes, Ef, alpha1, alpha2, r1, r2 = datetimes[keep], Ef[keep], alpha1[keep], alpha2[keep], r1[keep], r2[keep]
+        timestep_ids = timestep_ids[keep]
+
+    # alphas are written back out in met degrees
+    alpha1_met = u.math_to_met_dir(alpha1)
+    alpha2_met = u.math_to_met_dir(alpha2)
+
+    # D is saved for timesteps in the date range or matched to a storm
+    in_date_range = (datetimes >= start_date) & (datetimes <= end_date)
+    is_storm_case = np.array([save_is_storm and int(ts_id) in storm_dict for ts_id in timestep_ids], dtype=bool)
+    save_mask = in_date_range | is_storm_case
+
+    options = {
+        'storage': storage,
+        'packed_store_D': c.packed_store_D,
+        'boot_replicates': c.modality_bootstrap_replicates,
+        'boot_dof': c.modality_bootstrap_dof,
+        'boot_seed': c.modality_bootstrap_seed,
+    }
+
+    chunks = []
+    for start in range(0, len(datetimes), chunk_size):
+        sl = slice(start, min(start + chunk_size, len(datetimes)))
+        chunks.append((timestep_ids[sl], save_mask[sl], Ef[sl], alpha1[sl], alpha2[sl], r1[sl], r2[sl],
+                       alpha1_met[sl], alpha2_met[sl], options))
+
+    if n_workers > 1 and len(chunks) > 1:
+        # spread the chunks over a process pool, each worker on its own pooled connection
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(chunks)), initializer=_init_worker,
+                                 initargs=(c.noaa_freqs, resolution_deg)) as pool:
+            list(pool.map(_run_chunk, chunks))
+    else:
+        # process_chunk commits each batch itself
+        grid = make_grid(c.noaa_freqs, resolution_deg)
+        with db.session(commit=False) as s:
+            for chunk in chunks:
+                process_chunk(s, grid, *chunk)
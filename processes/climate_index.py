@@ -0,0 +1,80 @@
+import os
+import numpy as np
+import pandas as pd
+
+# modules
+import config.config as c
+
+resources_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resources')
+
+# monthly climate indices read from resources/, each row of the file is a year followed by 12 values
+# months gives the calendar month each of the 12 columns is assigned to
+climate_indices = {
+    # MEI v2 bimonthly seasons DJ, JF, ..., ND, DJ is assigned to December of the row's year
+    'MEI': {'file': 'meiv2.data', 'months': [12, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11], 'missing': -999.0},
+    # NOAA PSL monthly tables (Jan..Dec), read if the files are added to resources/
+    'ONI': {'file': 'oni.data', 'months': list(range(1, 13)), 'missing': -99.9},
+    'PDO': {'file': 'pdo.data', 'months': list(range(1, 13)), 'missing': 99.99},
+}
+
+# name -> (base key, values), key = year*12 + month - 1
+_loaded = {}
+
+def parse_monthly_table(path, months, missing):
+    # year + 12 values per line, header/footer lines of other shapes are skipped
+    rows = []
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 13 and parts[0].isdigit():
+                rows.append([float(p) for p in parts])
+    table = np.array(rows)
+
+    years = table[:, 0].astype(int)
+    first_year, last_year = years.min(), years.max()
+    base = first_year * 12
+    values = np.full((last_year - first_year + 1) * 12, np.nan)
+
+    col_months = np.array(months)
+    keys = years[:, None] * 12 + col_months[None, :] - 1
+    vals = table[:, 1:]
+    vals = np.where(np.isclose(vals, missing), np.nan, vals)
+    values[(keys - base).ravel()] = vals.ravel()
+    return base, values
+
+def load_index(name):
+    # in-memory first, then the on-disk cache if it is newer than the source file, then the source file
+    if name in _loaded:
+        return _loaded[name]
+
+    spec = climate_indices[name]
+    source = os.path.join(resources_path, spec['file'])
+    source_mtime = os.path.getmtime(source)
+    cache_file = os.path.join(c.cache_path, 'climate_index', f"{name}.npz")
+
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            if float(cached['source_mtime']) == source_mtime:
+                _loaded[name] = (int(cached['base']), cached['values'])
+                return _loaded[name]
+
+    base, values = parse_monthly_table(source, spec['months'], spec['missing'])
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    np.savez(cache_file, base=base, values=values, source_mtime=source_mtime)
+    _loaded[name] = (base, values)
+    return _loaded[name]
+
+def index_values(name, datetimes):
+    # O(1) lookup per timestep, NaN outside the index's range
+    base, values = load_index(name)
+    datetimes = pd.DatetimeIndex(datetimes)
+    pos = datetimes.year.to_numpy() * 12 + datetimes.month.to_numpy() - 1 - base
+    in_range = (pos >= 0) & (pos < len(values))
+    return np.where(in_range, values[np.clip(pos, 0, len(values) - 1)], np.nan)
+
+def attach_climate_indices(df_txt, names=('MEI',)):
+    # adds one column per index to df_txt in place
+    datetimes = df_txt['datetime']
+    for name in names:
+        df_txt[name] = index_values(name, datetimes)
+    return df_txt
@@ -1,14 +1,15 @@
-import psycopg2
-
-conn = psycopg2.connect(
-    dbname="postgres",
-    user="Jacob",
-    password="",
-    host="localhost",
-    port="5432"
-)
-
-def create_tables(conn):
+from contextlib import closing
+
+# modules
+import data.db as db
+import data.copy_writer as cw
+
+def create_tables(conn=None):
+    # without a connection, borrows a plain pooled connection from data.db; the function commits it itself,
+    # so it does not run inside a db.session transaction
+    if conn is None:
+        with closing(db.get_engine().raw_connection()) as conn:
+            return create_tables(conn)
     with conn.cursor() as cur:
         cur.execute("""
             CREATE TABLE dirspec.buoys (
@@ -55,6 +56,21 @@ def create_tables(conn):
                 m_1 FLOAT,
                 te FLOAT,
                 p FLOAT,
+                m1 FLOAT,
+                m2 FLOAT,
+                m4 FLOAT,
+                tm01 FLOAT,              -- Mean period m0/m1
+                tm02 FLOAT,              -- Zero-crossing period sqrt(m0/m2)
+                spectral_width FLOAT,    -- Cartwright & Longuet-Higgins epsilon
+                spectral_narrowness FLOAT, -- Longuet-Higgins nu
+                fp FLOAT,                -- Peak frequency (parabolic fit)
+                tp FLOAT,                -- Peak period 1/fp
+                mean_dir FLOAT,          -- Energy-weighted mean direction from r1/alpha1 (met degrees)
+                dir_spread FLOAT,        -- Directional spread (degrees)
+                mean_dir_swell FLOAT,
+                dir_spread_swell FLOAT,
+                mean_dir_sea FLOAT,
+                dir_spread_sea FLOAT,
 
                 -- Ingestion and source tracking
                 spectra_ingested BOOLEAN DEFAULT FALSE,
@@ -117,4 +133,104 @@ def create_tables(conn):
 
         """)
 
-        conn.commit()
\ No newline at end of file
+        cur.execute("""
+            CREATE TABLE dirspec.spectra_packed (
+                time_step_id TEXT,
+
+                -- Fourier inputs packed per timestep, indexed by frequency bin
+                energy_density REAL[],
+                r1 REAL[],
+                r2 REAL[],
+                alpha1 REAL[],
+                alpha2 REAL[],
+
+                -- Optional packed D (frequency-major, frequency x direction), NULL when rebuilt on demand
+                spreading REAL[],
+
+                PRIMARY KEY (time_step_id),
+                FOREIGN KEY (time_step_id) REFERENCES dirspec.time_steps (id)
+            );
+
+        """)
+
+        cur.execute("""
+            CREATE TABLE dirspec.ingest_marks (
+                station_id TEXT,
+                source TEXT,                 -- e.g., 'noaa-rt'
+
+                -- newest timestep fully ingested (time_steps + spectra) for the station
+                last_timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+
+                PRIMARY KEY (station_id, source)
+            );
+
+        """)
+
+        conn.commit()
+
+def migrate(conn=None):
+    # idempotent upgrades for a database created before the current create_tables, safe to run every start
+    if conn is None:
+        with closing(db.get_engine().raw_connection()) as conn:
+            return migrate(conn)
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS dirspec.ingest_marks (
+                station_id TEXT,
+                source TEXT,
+                last_timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                updated_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now(),
+
+                PRIMARY KEY (station_id, source)
+            );
+        """)
+
+        # packed spectra storage, spectra_storage = 'packed'
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS dirspec.spectra_packed (
+                time_step_id TEXT,
+                energy_density REAL[],
+                r1 REAL[],
+                r2 REAL[],
+                alpha1 REAL[],
+                alpha2 REAL[],
+                spreading REAL[],
+
+                PRIMARY KEY (time_step_id),
+                FOREIGN KEY (time_step_id) REFERENCES dirspec.time_steps (id)
+            );
+        """)
+
+        # one realtime deployment per station, extended in place by query.upsert_realtime_deployment
+        cur.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS buoy_deployments_rt_key
+                ON dirspec.buoy_deployments (deployment_id)
+                WHERE deployment_id LIKE 'NOAA-%-rt';
+        """)
+
+        # spectral moment, period, width, peak and direction columns
+        cur.execute("""
+            ALTER TABLE dirspec.time_steps
+                ADD COLUMN IF NOT EXISTS m1 FLOAT,
+                ADD COLUMN IF NOT EXISTS m2 FLOAT,
+                ADD COLUMN IF NOT EXISTS m4 FLOAT,
+                ADD COLUMN IF NOT EXISTS tm01 FLOAT,
+                ADD COLUMN IF NOT EXISTS tm02 FLOAT,
+                ADD COLUMN IF NOT EXISTS spectral_width FLOAT,
+                ADD COLUMN IF NOT EXISTS spectral_narrowness FLOAT,
+                ADD COLUMN IF NOT EXISTS fp FLOAT,
+                ADD COLUMN IF NOT EXISTS tp FLOAT,
+                ADD COLUMN IF NOT EXISTS mean_dir FLOAT,
+                ADD COLUMN IF NOT EXISTS dir_spread FLOAT;
+        """)
+
+        # per-band direction columns follow config.direction_bands
+        band_columns = cw.band_columns()
+        if band_columns:
+            cur.execute(f"""
+                ALTER TABLE dirspec.time_steps
+                    {', '.join(f'ADD COLUMN IF NOT EXISTS {col} FLOAT' for col in band_columns)};
+            """)
+
+        conn.commit()
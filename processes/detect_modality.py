@@ -49,4 +49,137 @@ def detect_modality_from_dmatrix(S: np.ndarray,
     elif bins_with_multipeaks >= min_bins_with_peaks:
         return "bimodal"
     else:
-        return "unimodal"
\ No newline at end of file
+        return "unimodal"
+
+def detect_modality_batch(S_stack: np.ndarray,
+                          direction_smoothing=2,
+                          min_peak_prominence=0.05,
+                          min_peak_separation_deg=30,
+                          min_bins_with_peaks=2,
+                          mode='reflect',
+                          block_rows=2048) -> np.ndarray:
+    """
+    Detects wave modality for a stack of directional energy matrices S(t, f, θ).
+
+    Same rules as detect_modality_from_dmatrix, with the smoothing, peak search,
+    prominence and separation checks done as array operations over every
+    frequency row of every timestep.
+
+    Parameters:
+        S_stack: 3D numpy array of shape [timesteps, frequency_bins, direction_bins]
+        mode: edge handling for the smoothing, 'reflect' matches
+              detect_modality_from_dmatrix, 'wrap' smooths circularly in direction
+        block_rows: frequency rows handled per pass of the prominence search
+        (other parameters as in detect_modality_from_dmatrix)
+
+    Returns:
+        numpy array of 'unimodal', 'bimodal', or 'undetermined', one per timestep
+    """
+    n_t, n_freq_bins, n_dir_bins = S_stack.shape
+    rows = S_stack.reshape(n_t * n_freq_bins, n_dir_bins)
+
+    multipeak = multipeak_rows(rows, direction_smoothing, min_peak_prominence, min_peak_separation_deg, mode, block_rows)
+
+    # skip empty or very low energy bins
+    multipeak &= ~(np.sum(rows, axis=1) < 1e-6)
+    bins_with_multipeaks = multipeak.reshape(n_t, n_freq_bins).sum(axis=1)
+
+    labels = np.where(bins_with_multipeaks >= min_bins_with_peaks, "bimodal", "unimodal").astype(object)
+    # return undetermined if the wave energy is low
+    labels[np.sum(S_stack.reshape(n_t, -1), axis=1) < 1e-3] = "undetermined"
+    return labels
+
+def multipeak_rows(rows: np.ndarray,
+                   direction_smoothing=2,
+                   min_peak_prominence=0.05,
+                   min_peak_separation_deg=30,
+                   mode='reflect',
+                   block_rows=2048) -> np.ndarray:
+    """
+    Per-row part of detect_modality_batch: True where a frequency row has two
+    prominent peaks at least min_peak_separation_deg apart after smoothing.
+    The low-energy row skip and the per-timestep vote are left to the caller.
+
+    Parameters:
+        rows: 2D numpy array of shape [rows, direction_bins], any positive
+              scaling of a row gives the same answer
+        (other parameters as in detect_modality_batch)
+
+    Returns:
+        boolean numpy array, one per row
+    """
+    # Direction bin resolution in degrees
+    deg_per_bin = 360 / rows.shape[1]
+    min_peak_separation_bins = int(min_peak_separation_deg / deg_per_bin)
+
+    # smooth every frequency row along direction in one call
+    smoothed = gaussian_filter1d(rows, sigma=direction_smoothing, axis=-1, mode=mode)
+
+    # only rows with two or more candidate maxima can hold two peaks, the prominence search skips the rest
+    maybe = np.flatnonzero(_candidate_peak_count(smoothed) >= 2)
+    multipeak = np.zeros(len(rows), dtype=bool)
+    for start in range(0, len(maybe), block_rows):
+        pos = maybe[start:start + block_rows]
+        block = smoothed[pos]
+        is_peak = _prominent_peaks(block, min_peak_prominence * np.max(block, axis=1))
+        multipeak[pos] = _has_separated_peaks(is_peak, min_peak_separation_bins)
+    return multipeak
+
+def _candidate_peak_count(x):
+    # per row, positions that rise from the left and do not drop to the right (interior only).
+    # Every find_peaks peak starts its plateau at one of these, so the count bounds the number of peaks
+    rises = x[:, 1:-1] > x[:, :-2]
+    holds = x[:, 1:-1] >= x[:, 2:]
+    return np.count_nonzero(rises & holds, axis=1)
+
+def _prominent_peaks(x, min_prominence):
+    # boolean mask of local maxima in each row with prominence >= min_prominence,
+    # following scipy.signal.find_peaks (flat tops resolve to their middle, edges are never peaks)
+    n_rows, n = x.shape
+    idx = np.arange(n)
+
+    # end of the run of equal values each position belongs to
+    change_at = np.where(x[:, 1:] != x[:, :-1], idx[None, :-1], n - 1)
+    run_end = np.minimum.accumulate(np.concatenate([change_at, np.full((n_rows, 1), n - 1)], axis=1)[:, ::-1], axis=1)[:, ::-1]
+
+    # rising edge followed (after any plateau) by a drop
+    ahead = np.minimum(run_end + 1, n - 1)
+    rows_idx = np.arange(n_rows)[:, None]
+    left = np.concatenate([np.full((n_rows, 1), np.inf), x[:, :-1]], axis=1)
+    rising = (left < x) & (idx[None, :] >= 1) & (idx[None, :] <= n - 2)
+    falls = x[rows_idx, ahead] < x
+    edge = rising & falls
+    peak_pos = np.where(edge, (idx[None, :] + ahead - 1) // 2, -1)
+
+    is_peak = np.zeros((n_rows, n), dtype=bool)
+    r, p = np.nonzero(edge)
+    is_peak[r, peak_pos[r, p]] = True
+
+    # prominence: peak height above the higher of the two lowest points reached
+    # before a strictly higher point (or the row edge) on each side, computed only for the peaks
+    r, p = np.nonzero(is_peak)
+    vals = x[r]
+    height = x[r, p][:, None]
+    higher = vals > height
+
+    left_hit = higher & (idx[None, :] < p[:, None])
+    left_bound = np.where(left_hit.any(axis=1), n - 1 - np.argmax(left_hit[:, ::-1], axis=1), -1)
+    right_hit = higher & (idx[None, :] > p[:, None])
+    right_bound = np.where(right_hit.any(axis=1), np.argmax(right_hit, axis=1), n)
+
+    left_window = (idx[None, :] > left_bound[:, None]) & (idx[None, :] <= p[:, None])
+    right_window = (idx[None, :] >= p[:, None]) & (idx[None, :] < right_bound[:, None])
+    left_min = np.where(left_window, vals, np.inf).min(axis=1)
+    right_min = np.where(right_window, vals, np.inf).min(axis=1)
+    prominence = height[:, 0] - np.maximum(left_min, right_min)
+
+    is_peak[r, p] = prominence >= min_prominence[r]
+    return is_peak
+
+def _has_separated_peaks(is_peak, min_separation_bins):
+    # True for rows where two consecutive peaks are at least min_separation_bins apart
+    n = is_peak.shape[1]
+    pos = np.where(is_peak, np.arange(n)[None, :], -1)
+    prev = np.maximum.accumulate(np.concatenate([np.full((len(pos), 1), -1), pos[:, :-1]], axis=1), axis=1)
+    sep = (np.arange(n)[None, :] - prev) % n
+    return (is_peak & (prev >= 0) & (sep >= min_separation_bins)).any(axis=1)
@@ -0,0 +1,103 @@
+import numpy as np
+
+# modules
+from processes.calc_D import spreading, modality_sigma
+from processes.detect_modality import multipeak_rows
+
+# version tag written to time_steps.modality_ver with the confidence
+MODALITY_VER = 'boot-v1'
+
+# classifier settings, the detect_modality_batch defaults calc_D runs with
+min_bins_with_peaks = 2
+min_row_energy = 1e-6
+
+def fourier_sigmas(r1, r2, dof):
+    # first-order sampling standard deviations of r1, alpha1, r2, alpha2 (radians)
+    # for moments estimated from dof degrees of freedom. The moments are sample means
+    # of cos/sin(n(theta - alpha_n)), so e.g. var(r1) = ((1 + r2) / 2 - r1^2) / dof and
+    # var(alpha1) = (1 - r2) / (2 dof r1^2). The unobserved 4th moment uses the
+    # wrapped-normal relation r4 = r2^4
+    r4 = r2 ** 4
+    sigma_r1 = np.sqrt(np.clip((1 + r2) / 2 - r1 ** 2, 0, None) / dof)
+    sigma_r2 = np.sqrt(np.clip((1 + r4) / 2 - r2 ** 2, 0, None) / dof)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma_a1 = np.sqrt(np.clip(1 - r2, 0, None) / (2 * dof)) / r1
+        sigma_a2 = np.sqrt(np.clip(1 - r4, 0, None) / (2 * dof)) / (2 * r2)
+    # no direction information left once r is 0, spread over the full circle
+    sigma_a1 = np.where(r1 > 0, np.minimum(sigma_a1, np.pi), np.pi)
+    sigma_a2 = np.where(r2 > 0, np.minimum(sigma_a2, np.pi / 2), np.pi / 2)
+    return sigma_r1, sigma_a1, sigma_r2, sigma_a2
+
+def perturb_fourier(alpha1, alpha2, r1, r2, n_replicates, dof, rng):
+    # (R, T, F) replicates of the Fourier inputs drawn within their sampling uncertainty
+    sigma_r1, sigma_a1, sigma_r2, sigma_a2 = fourier_sigmas(r1, r2, dof)
+    shape = (n_replicates,) + r1.shape
+    r1_rep = np.clip(r1 + sigma_r1 * rng.standard_normal(shape), 0, 1)
+    r2_rep = np.clip(r2 + sigma_r2 * rng.standard_normal(shape), 0, 1)
+    alpha1_rep = alpha1 + sigma_a1 * rng.standard_normal(shape)
+    alpha2_rep = alpha2 + sigma_a2 * rng.standard_normal(shape)
+    return alpha1_rep, alpha2_rep, r1_rep, r2_rep
+
+def row_order(Ef, point_multipeak, live):
+    # (T, F) frequency rows in the order replicates test them: the point estimate's multipeak rows first,
+    # then by energy, rows under the energy cutoff last (they never count)
+    rank = np.where(live, np.where(point_multipeak, 0, 1), 2)
+    energy = np.where(live, Ef, 0.0)
+    return np.lexsort((-energy, rank), axis=-1)
+
+def bootstrap_modality(Ef, alpha1, alpha2, r1, r2, labels, n_replicates=200, dof=32, resolution_deg=5, seed=0, block_size=8):
+    # confidence per timestep = share of replicates that reproduce the point modality label
+    # alpha in math radians, all inputs (T, F). Replicates for a block of timesteps are drawn in one pass.
+    # A replicate is bimodal once min_bins_with_peaks of its rows are multipeak, so rows are classified in
+    # rounds and a replicate stops as soon as that is reached; D is only built for the rows a round tests.
+    # The peak search does not depend on a row's scale, so rows are classified on the unnormalised D, and
+    # the energy cutoff and the 'undetermined' total are taken from Ef, which the replicates do not perturb
+    rng = np.random.default_rng(seed)
+    n_t, n_f = Ef.shape
+    labels = np.asarray(labels)
+    sigma = modality_sigma(resolution_deg)
+
+    # rows that can count at all: S sums to Ef / dtheta over a row
+    with np.errstate(invalid='ignore'):
+        live = Ef / np.deg2rad(resolution_deg) >= min_row_energy
+    point_multipeak = multipeak_rows(spreading(alpha1, alpha2, r1, r2, resolution_deg).reshape(n_t * n_f, -1),
+                                     sigma).reshape(n_t, n_f)
+    order = row_order(Ef, point_multipeak, live)
+    n_live = live.sum(axis=1)
+
+    # an undetermined timestep stays undetermined in every replicate
+    conf = np.ones(n_t)
+    determined = labels != 'undetermined'
+
+    for start in range(0, n_t, block_size):
+        stop = min(start + block_size, n_t)
+        alpha1_rep, alpha2_rep, r1_rep, r2_rep = perturb_fourier(
+            alpha1[start:stop], alpha2[start:stop], r1[start:stop], r2[start:stop], n_replicates, dof, rng)
+        blocks = np.flatnonzero(determined[start:stop])
+        if len(blocks) == 0:
+            continue
+
+        count = np.zeros((n_replicates, stop - start), dtype=int)
+        lo, width = 0, min_bins_with_peaks
+        while lo < n_f:
+            hi = min(lo + width, n_f)
+            rep, b = np.nonzero(count[:, blocks] < min_bins_with_peaks)
+            b = blocks[b]
+            # the next rows of each undecided replicate, past the timestep's live rows nothing is left to test
+            k = np.arange(lo, hi)
+            test = k[None, :] < n_live[start + b][:, None]
+            if not test.any():
+                break
+            rep = np.broadcast_to(rep[:, None], test.shape)[test]
+            f = order[start + b][:, lo:hi][test]
+            b = np.broadcast_to(b[:, None], test.shape)[test]
+
+            D = spreading(alpha1_rep[rep, b, f], alpha2_rep[rep, b, f], r1_rep[rep, b, f], r2_rep[rep, b, f], resolution_deg)
+            hit = multipeak_rows(D, sigma)
+            np.add.at(count, (rep[hit], b[hit]), 1)
+            lo, width = hi, width * 2
+
+        rep_labels = np.where(count[:, blocks] >= min_bins_with_peaks, 'bimodal', 'unimodal')
+        conf[start + blocks] = np.mean(rep_labels == labels[start + blocks][None, :], axis=0)
+
+    return conf
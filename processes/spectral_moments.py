@@ -0,0 +1,89 @@
+import numpy as np
+
+# bulk wave parameters for every timestep at once from the (T, F) spectra
+# frequency-power weights f^n * df are built once per frequency table and reused
+
+# moment orders kept in the weight table
+moment_orders = (-1, 0, 1, 2, 4)
+
+_weights = {}
+
+def moment_weights(freqs, bandwidths):
+    # {n: f^n * df} for each moment order, cached on the frequency table
+    freqs = np.asarray(freqs, dtype=float)
+    bandwidths = np.asarray(bandwidths, dtype=float)
+    key = (freqs.tobytes(), bandwidths.tobytes())
+    if key not in _weights:
+        _weights[key] = {n: freqs ** n * bandwidths for n in moment_orders}
+    return _weights[key]
+
+def parabolic_peak(Ef, freqs):
+    # peak frequency from a parabola through the highest bin and its neighbours,
+    # falls back to the bin frequency at the spectrum edges or a flat top
+    n_t, n_f = Ef.shape
+    valid = ~np.all(np.isnan(Ef), axis=1)
+    k = np.where(valid, np.nanargmax(np.where(valid[:, None], Ef, 0.0), axis=1), 0)
+    fp = np.where(valid, freqs[k], np.nan)
+
+    interior = valid & (k > 0) & (k < n_f - 1)
+    km, kp = np.clip(k - 1, 0, n_f - 1), np.clip(k + 1, 0, n_f - 1)
+    rows = np.arange(n_t)
+    x0, x1, x2 = freqs[km], freqs[k], freqs[kp]
+    y0, y1, y2 = Ef[rows, km], Ef[rows, k], Ef[rows, kp]
+
+    # vertex of the parabola through three (possibly unevenly spaced) points
+    num = (x1 - x0) ** 2 * (y1 - y2) - (x1 - x2) ** 2 * (y1 - y0)
+    den = (x1 - x0) * (y1 - y2) - (x1 - x2) * (y1 - y0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vertex = x1 - 0.5 * num / den
+    ok = interior & np.isfinite(vertex) & (den != 0) & (vertex >= x0) & (vertex <= x2)
+    return np.where(ok, vertex, fp)
+
+def mean_direction(Ef, r1, alpha1_met, df_weights, band_mask=None):
+    # energy-weighted mean direction (met degrees) and circular spread (degrees) from r1/alpha1
+    # spread = sqrt(2 (1 - |<r1 e^(i alpha1)>|)), bins missing r1 or alpha1 carry no weight
+    w = Ef * df_weights
+    if band_mask is not None:
+        w = w * band_mask
+    have_dir = ~(np.isnan(r1) | np.isnan(alpha1_met) | np.isnan(w))
+    w = np.where(have_dir, w, 0.0)
+    rad = np.deg2rad(np.where(have_dir, alpha1_met, 0.0))
+    r1 = np.where(have_dir, r1, 0.0)
+
+    total = w.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = (w * r1 * np.cos(rad)).sum(axis=1) / total
+        b = (w * r1 * np.sin(rad)).sum(axis=1) / total
+    direction = np.mod(np.rad2deg(np.arctan2(b, a)), 360)
+    spread = np.rad2deg(np.sqrt(2 * np.clip(1 - np.hypot(a, b), 0, None)))
+    empty = ~(total > 0)
+    return np.where(empty, np.nan, direction), np.where(empty, np.nan, spread)
+
+def bulk_parameters(Ef, freqs, bandwidths, r1=None, alpha1_met=None, direction_bands=None):
+    # dict of (T,) arrays keyed by df_txt column name
+    freqs = np.asarray(freqs, dtype=float)
+    w = moment_weights(freqs, bandwidths)
+    m = {n: Ef @ w[n] for n in moment_orders}
+
+    out = {'m0': m[0], 'm_1': m[-1], 'm1': m[1], 'm2': m[2], 'm4': m[4]}
+    out['hm0'] = 4 * np.sqrt(m[0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out['Te'] = m[-1] / m[0]
+        out['Tm01'] = m[0] / m[1]
+        out['Tm02'] = np.sqrt(m[0] / m[2])
+        # Cartwright & Longuet-Higgins width and Longuet-Higgins narrowness
+        out['width'] = np.sqrt(np.clip(1 - m[2] ** 2 / (m[0] * m[4]), 0, None))
+        out['narrowness'] = np.sqrt(np.clip(m[0] * m[2] / m[1] ** 2 - 1, 0, None))
+    out['P'] = (1025 * 9.81**2 * out['hm0']**2 * out['Te']) / (64 * np.pi * 1000)
+
+    out['fp'] = parabolic_peak(Ef, freqs)
+    with np.errstate(divide='ignore'):
+        out['Tp'] = 1 / out['fp']
+
+    if r1 is not None and alpha1_met is not None:
+        out['mean_dir'], out['dir_spread'] = mean_direction(Ef, r1, alpha1_met, w[0])
+        for band, (f_lo, f_hi) in (direction_bands or {}).items():
+            band_mask = ((freqs >= f_lo) & (freqs < f_hi)).astype(float)
+            out[f'mean_dir_{band}'], out[f'dir_spread_{band}'] = mean_direction(Ef, r1, alpha1_met, w[0], band_mask)
+
+    return out
@@ -0,0 +1,106 @@
+import os
+import json
+import pickle
+import numpy as np
+import pandas as pd
+
+# modules
+import config.config as c
+
+# station catalogs loaded once per process: 'ndbc' is activestations.xml (buoy metadata),
+# 'coops' is stations.json (tide stations). Each is pickled under cache_path/stations with the
+# source file's mtime and rebuilt when the source changes
+earth_radius_km = 6371.0
+
+_registries = {}
+
+def _read_ndbc():
+    df = pd.read_xml(c.noaa_stations_path)
+    df['id'] = df['id'].astype(str)
+    return df
+
+def _read_coops():
+    with open(c.stations_path, 'r') as f:
+        stations = json.load(f)['stations']
+    return pd.DataFrame([{
+        'id': str(s['id']),
+        'name': s['name'],
+        'lat': s['lat'],
+        'lon': s['lng'],
+        'state': s.get('state', None)
+    } for s in stations])
+
+catalogs = {
+    'ndbc': {'path': lambda: c.noaa_stations_path, 'read': _read_ndbc},
+    'coops': {'path': lambda: c.stations_path, 'read': _read_coops},
+}
+
+def unit_vectors(lat, lon):
+    # lat/lon in degrees -> points on the unit sphere, chord distance is monotonic in great-circle distance
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+def _build(df):
+    from scipy.spatial import cKDTree
+    df = df.reset_index(drop=True)
+    # stations without a position can still be looked up by id, but are left out of the tree
+    has_pos = df['lat'].notna() & df['lon'].notna()
+    tree_rows = np.flatnonzero(has_pos.to_numpy())
+    return {
+        'df': df,
+        'pos': dict(zip(df['id'], range(len(df)))),
+        'tree': cKDTree(unit_vectors(df.loc[has_pos, 'lat'], df.loc[has_pos, 'lon'])),
+        'tree_rows': tree_rows,
+    }
+
+def load_registry(name):
+    if name in _registries:
+        return _registries[name]
+
+    source = catalogs[name]['path']()
+    source_mtime = os.path.getmtime(source)
+    cache_file = os.path.join(c.cache_path, 'stations', f"{name}.pkl")
+
+    if os.path.exists(cache_file):
+        with open(cache_file, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['source_mtime'] == source_mtime:
+            _registries[name] = cached['registry']
+            return _registries[name]
+
+    registry = _build(catalogs[name]['read']())
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    with open(cache_file, 'wb') as f:
+        pickle.dump({'source_mtime': source_mtime, 'registry': registry}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    _registries[name] = registry
+    return registry
+
+def get_station(name, station_id):
+    # 1-row dataframe for the station id, empty if it isn't in the catalog
+    registry = load_registry(name)
+    pos = registry['pos'].get(str(station_id))
+    if pos is None:
+        return registry['df'].iloc[0:0]
+    return registry['df'].iloc[[pos]]
+
+def _with_distances(registry, tree_pos, chord):
+    rows = registry['df'].iloc[registry['tree_rows'][tree_pos]].copy()
+    rows['distance_km'] = 2 * earth_radius_km * np.arcsin(np.clip(chord / 2, 0, 1))
+    return rows
+
+def nearest(name, lat, lon, k=1):
+    # k closest stations to (lat, lon), closest first, with distance_km
+    registry = load_registry(name)
+    k = min(k, len(registry['tree_rows']))
+    chord, tree_pos = registry['tree'].query(unit_vectors([lat], [lon])[0], k=k)
+    return _with_distances(registry, np.atleast_1d(tree_pos), np.atleast_1d(chord))
+
+def within_radius(name, lat, lon, radius_km):
+    # every station within radius_km of (lat, lon), closest first, with distance_km
+    registry = load_registry(name)
+    point = unit_vectors([lat], [lon])[0]
+    tree_pos = np.asarray(registry['tree'].query_ball_point(point, r=2 * np.sin(radius_km / (2 * earth_radius_km)) + 1e-9), dtype=int)
+    chord = np.linalg.norm(registry['tree'].data[tree_pos] - point, axis=1)
+    order = np.argsort(chord)
+    return _with_distances(registry, tree_pos[order], chord[order])
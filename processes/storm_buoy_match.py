@@ -1,22 +1,29 @@
-from math import radians, sin, cos, sqrt, atan2
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine, text
-import psycopg2
+from sqlalchemy import text
 from psycopg2.extras import execute_values
 
-conn = psycopg2.connect(
-    dbname="postgres",
-    user="Jacob",
-    password="",
-    host="localhost",
-    port="5432"
-)
+# modules
+import data.db as db
+import data.ref_cache as rc
+import processes.station_registry as sr
 
-CONN_STR = "postgresql+psycopg2://Jacob:@localhost:5432/postgres"
-engine = create_engine(CONN_STR)
-conn_eng = engine.connect() 
+# reads go through data.db, on the caller's open session when there is one
+
+def storm_buoy_match(cur, storm_df, buoy_df, max_distance_km, deployment_id, mode='client'):
+    # mode 'server' runs the whole match inside postgres with storm_buoy_match_sql
+    if mode == 'server':
+        if storm_df is not None:
+            timestamps = pd.to_datetime(storm_df['timestamp'], utc=True)
+            storm_buoy_match_sql(cur, max_distance_km, start_datetime=timestamps.min(), end_datetime=timestamps.max())
+            return None
+        elif buoy_df is not None:
+            timestamps = pd.to_datetime(buoy_df['datetime'], utc=True)
+            matched_ids = storm_buoy_match_sql(cur, max_distance_km, buoy_id=get_buoy_id(buoy_df.loc[0,'station_id']),
+                                               deployment_id=deployment_id,
+                                               start_datetime=timestamps.min(), end_datetime=timestamps.max())
+            return buoy_df, {ts_id: True for ts_id in matched_ids}
 
-def storm_buoy_match(cur, storm_df, buoy_df, max_distance_km, deployment_id):
     # if updating storms tables or adding a buoy
     # for each stormtrack timestep -> filter to buoy timesteps within 15 min of the timestep
     # check haversine distance and windspeed at buoy at the timesteps
@@ -28,27 +35,29 @@ def storm_buoy_match(cur, storm_df, buoy_df, max_distance_km, deployment_id):
 
     # updating storms condition, storm_df is all new storm data
     if storm_df is not None:
-        # check each storm timestep for nearby buoys that meet conditions
-        for _, storm_row in storm_df.iterrows():
-            storm_timestamp = storm_row['timestamp']
-            storm_lat = storm_row['lat']
-            storm_lon = storm_row['lon']
-            hurdat_storm_id = storm_row['hurdat_storm_id']
-            
-            # query all buoys with this timestamp
-            buoys_with_ts = find_buoys_with_timestamp(storm_timestamp)
-
-            # check for conditions to set is_storm=True
-            for idx, buoy_row in buoys_with_ts.iterrows():
-                time_step_id = buoy_row['id']
-                dist = haversine_km(storm_lat, storm_lon, buoy_row['lat'], buoy_row['lon'])
-
-                if dist <= max_distance_km:
-                    # update database tables
-                    update_storm_match(cur, time_step_id, hurdat_storm_id, dist, storm_timestamp)
-                    buoys_with_ts, storm_name = update_buoy_time_steps(buoys_with_ts, storm_row, dist, idx)
-                    row_to_update = buoys_with_ts.iloc[idx]
-                    update_time_steps_table(cur, row_to_update, storm_name, time_step_id)
+        tracks = storm_df.copy()
+        tracks['timestamp'] = pd.to_datetime(tracks['timestamp'], utc=True)
+        if 'storm_name' not in tracks.columns:
+            storm_names = get_storm_names(tracks['hurdat_storm_id'].unique().tolist())
+            tracks['storm_name'] = tracks['hurdat_storm_id'].map(storm_names)
+
+        # spatial index over the deployment positions, built once
+        buoy_index = build_buoy_index(get_deployment_positions())
+
+        # each storm only checks deployments within max_distance_km of its track, with one timestep query per storm
+        all_matches = []
+        for _, storm_tracks in tracks.groupby('hurdat_storm_id'):
+            near = buoys_near_tracks(buoy_index, storm_tracks, max_distance_km)
+            if near.empty:
+                continue
+            buoy_ts = find_time_steps_for_buoys(near['buoy_id'].unique().tolist(),
+                                                storm_tracks['timestamp'].min(), storm_tracks['timestamp'].max())
+            all_matches.append(match_tracks_to_buoys(near, buoy_ts, max_distance_km))
+
+        if all_matches:
+            matches = pd.concat(all_matches, ignore_index=True)
+            insert_storm_matches(cur, matches)
+            update_time_steps_storms(cur, matches)
         return None
 
     # adding new buoy condition
@@ -56,152 +65,253 @@ def storm_buoy_match(cur, storm_df, buoy_df, max_distance_km, deployment_id):
         storm_dict = {}
 
         # find the start and end timestamps for the buoy data being pulled in
-        buoy_timestamps = buoy_df['datetime']
-        start_datetime = min(buoy_timestamps)
-        end_datetime = max(buoy_timestamps)
+        buoy_timestamps = pd.to_datetime(buoy_df['datetime'], utc=True)
+        start_datetime = buoy_timestamps.min()
+        end_datetime = buoy_timestamps.max()
         station_id = buoy_df.loc[0,'station_id']
 
         # get stormtrack timesteps within this timeframe
         storms_within_timestamps = find_storms_within_timestamps(start_datetime, end_datetime)
+        if storms_within_timestamps.empty:
+            return buoy_df, storm_dict
+
+        # get the deployment timesteps once, only the ones in the current buoy data can match
+        buoy_id = get_buoy_id(station_id)
+        buoy_ts = find_deployment_time_steps(buoy_id, deployment_id, start_datetime, end_datetime)
+        buoy_ts['timestamp'] = pd.to_datetime(buoy_ts['timestamp'], utc=True)
+        buoy_ts = buoy_ts[buoy_ts['timestamp'].isin(buoy_timestamps)]
+
+        # pair each stormtrack timestep with the closest buoy timestep and check distance
+        matches = match_tracks_to_time_steps(storms_within_timestamps, buoy_ts, max_distance_km)
 
-        for _, storm_row in storms_within_timestamps.iterrows():
-            storm_timestamp = storm_row['timestamp']
-            
-            # query the buoy timestep closest to the stormtrack timestep
-            buoy_id = get_buoy_id(station_id)
-            buoy_ts = find_buoy_timestamp(storm_timestamp, buoy_id, deployment_id)
-            if buoy_ts.empty == False:
-                timestamp = buoy_ts['timestamp'].iloc[0]
-                buoy_df_timestep = buoy_df[buoy_df['datetime'] == timestamp]
-
-                # check for conditions to set is_storm=True
-                for _, buoy_row in buoy_df_timestep.iterrows():
-                    storm_lat = storm_row['lat']
-                    storm_lon = storm_row['lon']
-                    dist = haversine_km(storm_lat, storm_lon, buoy_ts['lat'].iloc[0], buoy_ts['lon'].iloc[0])
-
-                    if dist <= max_distance_km:
-                        hurdat_storm_id = storm_row['hurdat_storm_id']
-                        time_step_id = int(buoy_ts['id'].iloc[0])
-
-                        # update database tables
-                        update_storm_match(cur, time_step_id, hurdat_storm_id, dist, storm_timestamp)
-                        buoy_df_timestep, storm_name = update_buoy_time_steps(buoy_row, storm_row, dist)
-                        update_time_steps_table(cur, buoy_row, storm_name, time_step_id)
-
-                        storm_dict[time_step_id] = True
+        # update database tables in bulk
+        insert_storm_matches(cur, matches)
+        update_time_steps_storms(cur, matches)
 
+        storm_dict = {int(ts_id): True for ts_id in matches['time_step_id']}
         return buoy_df, storm_dict
-    
+
+def storm_buoy_match_sql(cur, max_distance_km, buoy_id=None, deployment_id=None, start_datetime=None, end_datetime=None):
+    # match storm tracks to buoy timesteps in one statement inside postgres
+    # pairs each track point with the nearest deployment timestep within 15 minutes (per buoy, same rule as
+    # the client path), measures great-circle distance
+    # from the deployment position, inserts storm_matches and sets the time_steps storm fields (closest storm wins)
+    # any filter left as None is not applied, so with no filters every buoy is re-matched
+    cur.execute("""
+        WITH pairs AS (
+            SELECT DISTINCT ON (st.id, ts.buoy_id)
+                   ts.id AS time_step_id, st.hurdat_storm_id, st.timestamp AS storm_track_time,
+                   st.storm_type, st.heading, st.speed, s.storm_name,
+                   2 * 6371.0 * asin(LEAST(1.0, sqrt(
+                       power(sin(radians(bd.lat - st.lat) / 2), 2)
+                       + cos(radians(st.lat)) * cos(radians(bd.lat)) * power(sin(radians(bd.lon - st.lon) / 2), 2)
+                   ))) AS storm_distance_km
+            FROM storms.storm_tracks st
+            JOIN storms.storms s ON s.hurdat_storm_id = st.hurdat_storm_id
+            JOIN dirspec.time_steps ts
+              ON ts.timestamp BETWEEN (st.timestamp - INTERVAL '15 minutes')
+                                  AND (st.timestamp + INTERVAL '15 minutes')
+            JOIN dirspec.buoy_deployments bd
+              ON bd.buoy_id = ts.buoy_id
+             AND ts.timestamp BETWEEN bd.start_time AND bd.end_time
+            WHERE (%(buoy_id)s::int IS NULL OR ts.buoy_id = %(buoy_id)s::int)
+              AND (%(deployment_id)s::text IS NULL OR bd.deployment_id = %(deployment_id)s::text)
+              AND (%(start_datetime)s::timestamp IS NULL OR st.timestamp >= %(start_datetime)s::timestamp - INTERVAL '15 minutes')
+              AND (%(end_datetime)s::timestamp IS NULL OR st.timestamp <= %(end_datetime)s::timestamp + INTERVAL '15 minutes')
+            ORDER BY st.id, ts.buoy_id, abs(extract(epoch FROM ts.timestamp - st.timestamp)), ts.timestamp
+        ),
+        matches AS (
+            SELECT * FROM pairs WHERE storm_distance_km <= %(max_distance_km)s
+        ),
+        inserted AS (
+            INSERT INTO storms.storm_matches (time_step_id, hurdat_storm_id, storm_distance_km, storm_track_time)
+            SELECT time_step_id, hurdat_storm_id, storm_distance_km, storm_track_time FROM matches
+            ON CONFLICT (time_step_id, hurdat_storm_id) DO NOTHING
+        )
+        UPDATE dirspec.time_steps ts
+        SET storm_name = m.storm_name,
+            storm_type = m.storm_type,
+            storm_heading_deg = m.heading,
+            storm_speed_kts = m.speed,
+            storm_distance_km = m.storm_distance_km,
+            storm_section_9 = NULL,
+            hurdat_storm_id = m.hurdat_storm_id,
+            is_storm = TRUE
+        FROM (
+            SELECT DISTINCT ON (time_step_id) *
+            FROM matches
+            ORDER BY time_step_id, storm_distance_km
+        ) m
+        WHERE ts.id = m.time_step_id
+        RETURNING ts.id;
+    """, {
+        "max_distance_km": float(max_distance_km),
+        "buoy_id": None if buoy_id is None else int(buoy_id),
+        "deployment_id": None if deployment_id is None else str(deployment_id),
+        "start_datetime": start_datetime,
+        "end_datetime": end_datetime,
+    })
+    return [row[0] for row in cur.fetchall()]
+
+def match_tracks_to_time_steps(storm_tracks, buoy_ts, max_distance_km):
+    # align stormtrack rows to the nearest buoy timestep within 15 minutes and keep the ones within range
+    # buoy_ts needs id, timestamp, lat, lon
+    tracks = storm_tracks.copy()
+    tracks['timestamp'] = pd.to_datetime(tracks['timestamp'], utc=True)
+    tracks = tracks.sort_values('timestamp')
+
+    buoy_ts = buoy_ts.rename(columns={'id': 'time_step_id', 'timestamp': 'buoy_timestamp', 'lat': 'buoy_lat', 'lon': 'buoy_lon'})
+    buoy_ts = buoy_ts[['time_step_id', 'buoy_timestamp', 'buoy_lat', 'buoy_lon']].sort_values('buoy_timestamp')
+
+    paired = pd.merge_asof(tracks, buoy_ts, left_on='timestamp', right_on='buoy_timestamp',
+                           direction='nearest', tolerance=pd.Timedelta('15min'))
+    paired = paired.dropna(subset=['time_step_id'])
+    paired['time_step_id'] = paired['time_step_id'].astype('int64')
+
+    paired['storm_distance_km'] = haversine_km_np(paired['lat'].to_numpy(float), paired['lon'].to_numpy(float),
+                                                  paired['buoy_lat'].to_numpy(float), paired['buoy_lon'].to_numpy(float))
+    return paired[paired['storm_distance_km'] <= max_distance_km].reset_index(drop=True)
+
+def build_buoy_index(deployments):
+    from scipy.spatial import cKDTree
+    # KD-tree over deployment positions as unit vectors, chord distance stands in for great-circle distance
+    deployments = deployments.reset_index(drop=True)
+    deployments['start_time'] = pd.to_datetime(deployments['start_time'], utc=True)
+    deployments['end_time'] = pd.to_datetime(deployments['end_time'], utc=True)
+    return cKDTree(sr.unit_vectors(deployments['lat'], deployments['lon'])), deployments
+
+def buoys_near_tracks(buoy_index, tracks, max_distance_km):
+    # (track row, deployment) candidate pairs within max_distance_km, from one ball query per track set
+    tree, deployments = buoy_index
+    xyz = sr.unit_vectors(tracks['lat'], tracks['lon'])
+    chord = 2 * np.sin(max_distance_km / (2 * sr.earth_radius_km)) + 1e-9
+
+    hits = tree.query_ball_point(xyz, r=chord)
+    track_pos = np.repeat(np.arange(len(tracks)), [len(h) for h in hits])
+    buoy_pos = np.concatenate([np.asarray(h, dtype=int) for h in hits]) if len(hits) else np.array([], dtype=int)
+
+    near = tracks.iloc[track_pos].reset_index(drop=True)
+    near['track_pos'] = track_pos
+    near['buoy_id'] = deployments['buoy_id'].to_numpy()[buoy_pos]
+    near['buoy_lat'] = deployments['lat'].to_numpy(float)[buoy_pos]
+    near['buoy_lon'] = deployments['lon'].to_numpy(float)[buoy_pos]
+    near['start_time'] = deployments['start_time'].array[buoy_pos]
+    near['end_time'] = deployments['end_time'].array[buoy_pos]
+    # a deployment that ended or had not started within 15 minutes of the track point cannot match
+    window = pd.Timedelta('15min')
+    live = (near['start_time'] <= near['timestamp'] + window) & (near['end_time'] >= near['timestamp'] - window)
+    return near[live].reset_index(drop=True)
+
+def match_tracks_to_buoys(near, buoy_ts, max_distance_km):
+    # per track point and buoy, the nearest timestep within 15 minutes that falls inside the deployment,
+    # measured from the deployment position and kept when within range (the storm_buoy_match_sql rules)
+    buoy_ts = buoy_ts.rename(columns={'id': 'time_step_id', 'timestamp': 'buoy_timestamp'})
+    buoy_ts['buoy_timestamp'] = pd.to_datetime(buoy_ts['buoy_timestamp'], utc=True)
+    paired = near.merge(buoy_ts[['time_step_id', 'buoy_id', 'buoy_timestamp']], on='buoy_id')
+    gap = (paired['buoy_timestamp'] - paired['timestamp']).abs()
+    keep = (gap <= pd.Timedelta('15min')) & paired['buoy_timestamp'].between(paired['start_time'], paired['end_time'])
+    paired = paired.assign(gap=gap)[keep]
+    # ties go to the earlier timestep, as in the server statement
+    paired = paired.sort_values(['track_pos', 'buoy_id', 'gap', 'buoy_timestamp'])
+    paired = paired.drop_duplicates(['track_pos', 'buoy_id'])
+    paired = paired.drop(columns=['track_pos', 'gap', 'start_time', 'end_time'])
+
+    paired = paired.assign(storm_distance_km=haversine_km_np(
+        paired['lat'].to_numpy(float), paired['lon'].to_numpy(float),
+        paired['buoy_lat'].to_numpy(float), paired['buoy_lon'].to_numpy(float)))
+    return paired[paired['storm_distance_km'] <= max_distance_km].reset_index(drop=True)
+
+def haversine_km_np(lat1, lon1, lat2, lon2):
+    R = sr.earth_radius_km
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1)/2)**2
+    return 2 * R * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def insert_storm_matches(cur, matches):
+    if matches.empty:
+        return
+    execute_values(cur, """
+        INSERT INTO storms.storm_matches
+        (time_step_id, hurdat_storm_id, storm_distance_km, storm_track_time)
+        VALUES %s
+        ON CONFLICT (time_step_id, hurdat_storm_id) DO NOTHING;
+    """, list(zip(
+        matches['time_step_id'].tolist(), matches['hurdat_storm_id'].tolist(),
+        matches['storm_distance_km'].tolist(), matches['timestamp'].tolist()
+    )), page_size=1000)
+
+def update_time_steps_storms(cur, matches):
+    # one UPDATE for all matched timesteps, the closest storm wins when several match the same timestep
+    if matches.empty:
+        return
+    closest = matches.sort_values('storm_distance_km').drop_duplicates('time_step_id')
+    rows = list(zip(
+        closest['time_step_id'].tolist(), closest['storm_name'].tolist(), closest['storm_type'].tolist(),
+        closest['heading'].tolist(), closest['speed'].tolist(), closest['storm_distance_km'].tolist(),
+        closest['hurdat_storm_id'].tolist()
+    ))
+    execute_values(cur, """
+        UPDATE dirspec.time_steps ts
+        SET storm_name = v.storm_name,
+            storm_type = v.storm_type,
+            storm_heading_deg = v.storm_heading_deg::float,
+            storm_speed_kts = v.storm_speed_kts::float,
+            storm_distance_km = v.storm_distance_km::float,
+            storm_section_9 = NULL,
+            hurdat_storm_id = v.hurdat_storm_id,
+            is_storm = TRUE
+        FROM (VALUES %s) AS v (id, storm_name, storm_type, storm_heading_deg, storm_speed_kts, storm_distance_km, hurdat_storm_id)
+        WHERE ts.id = v.id;
+    """, rows, page_size=1000)
+
 def get_buoy_id(station_id):
     # Get buoy ID (assumes station_id already inserted in buoys)
-    buoy_id = pd.read_sql(text("""SELECT id FROM dirspec.buoys WHERE station_id = :station_id
-        """), conn_eng, params={"station_id": station_id})
-    return buoy_id.loc[0, 'id']
+    return rc.get_buoy_id(station_id)
+
+def get_deployment_positions():
+    # positions live on the deployments, a buoy that moved has one row per position
+    df = db.read_sql(text("""
+        SELECT bd.buoy_id, bd.deployment_id, bd.lat, bd.lon, bd.start_time, bd.end_time
+        FROM dirspec.buoy_deployments bd
+        WHERE bd.lat IS NOT NULL AND bd.lon IS NOT NULL
+    """))
+    return df
 
-def find_buoys_with_timestamp(storm_timestamp):   
-    df = pd.read_sql(text("""
-        SELECT ts.id, ts.timestamp, b.lat, b.lon  
+def find_time_steps_for_buoys(buoy_ids, start_datetime, end_datetime):
+    # the deployment window is applied per candidate in match_tracks_to_buoys
+    df = db.read_sql(text("""
+        SELECT ts.id, ts.buoy_id, ts.timestamp
         FROM dirspec.time_steps ts
-        JOIN dirspec.buoys b on ts.buoy_id = b.id
-        WHERE ts.timestamp BETWEEN (:storm_timestamp - INTERVAL '15 minutes')
-                               AND (:storm_timestamp + INTERVAL '15 minutes')    
-    """), conn_eng, params={"storm_timestamp": storm_timestamp})
+        WHERE ts.buoy_id = ANY(:buoy_ids)
+        AND ts.timestamp BETWEEN (:start_datetime - INTERVAL '15 minutes')
+                             AND (:end_datetime + INTERVAL '15 minutes')
+    """), params={"buoy_ids": [int(b) for b in buoy_ids],
+                            "start_datetime": start_datetime, "end_datetime": end_datetime})
     return df
 
-def find_buoy_timestamp(storm_timestamp, buoy_id, deployment_id):
-    df = pd.read_sql(text("""
-        SELECT ts.id, ts.timestamp, b.lat, b.lon  
+def get_storm_names(hurdat_storm_ids):
+    return {hurdat_storm_id: rc.get_storm_name(hurdat_storm_id) for hurdat_storm_id in hurdat_storm_ids}
+
+def find_deployment_time_steps(buoy_id, deployment_id, start_datetime, end_datetime):
+    df = db.read_sql(text("""
+        SELECT ts.id, ts.timestamp, b.lat, b.lon
         FROM dirspec.time_steps ts
         JOIN dirspec.buoy_deployments b on ts.buoy_id = b.buoy_id
-        WHERE ts.timestamp BETWEEN (:storm_timestamp - INTERVAL '15 minutes')
-                               AND (:storm_timestamp + INTERVAL '15 minutes')  
-        AND b.buoy_id = :buoy_id  
+        WHERE ts.timestamp BETWEEN (:start_datetime - INTERVAL '15 minutes')
+                               AND (:end_datetime + INTERVAL '15 minutes')
+        AND ts.timestamp BETWEEN b.start_time AND b.end_time
+        AND b.buoy_id = :buoy_id
         AND b.deployment_id = :deployment_id
-    """), conn_eng, params={"storm_timestamp": storm_timestamp, "buoy_id": int(buoy_id), "deployment_id": str(deployment_id)})
-    return df
-
-def find_stormtracks_with_timestamp(buoy_timestamp):
-    df = pd.read_sql(text("""
-        SELECT st.id, st.hurdat_storm_id, st.timestamp, st.lat, st.lon, st.wind_speed, st.pressure, st.heading, st.speed, st.storm_type, s.storm_name
-        FROM storms.storm_tracks st
-        JOIN storms.storms s on st.hurdat_storm_id = s.hurdat_storm_id
-        WHERE :buoy_timestamp BETWEEN (st.timestamp - INTERVAL '15 minutes')
-                                  AND (st.timestamp + INTERVAL '15 minutes')    
-    """), conn_eng, params={"buoy_timestamp": buoy_timestamp})   
+    """), params={"start_datetime": start_datetime, "end_datetime": end_datetime,
+                            "buoy_id": int(buoy_id), "deployment_id": str(deployment_id)})
     return df
 
-def get_storm_name(hurdat_storm_id):
-    df = pd.read_sql(text("""
-    SELECT s.storm_name
-    FROM storms.storms s
-    WHERE s.hurdat_storm_id = :hurdat_storm_id                      
-    """), conn_eng, params={"hurdat_storm_id": hurdat_storm_id})
-    return df['storm_name']    
-
 def find_storms_within_timestamps(start_datetime,end_datetime):
-    df = pd.read_sql(text("""
+    df = db.read_sql(text("""
         SELECT st.*, s.storm_name
         FROM storms.storm_tracks st
         JOIN storms.storms s ON st.hurdat_storm_id = s.hurdat_storm_id
         WHERE st.timestamp BETWEEN (:start_datetime - INTERVAL '15 minutes')
                               AND (:end_datetime + INTERVAL '15 minutes')
-    """), conn_eng, params={"start_datetime": start_datetime, "end_datetime": end_datetime})
+    """), params={"start_datetime": start_datetime, "end_datetime": end_datetime})
     return df
-
-def update_storm_match(cur, time_step_id, hurdat_storm_id, dist, storm_timestamp):
-    execute_values(cur, """
-        INSERT INTO storms.storm_matches
-        (time_step_id, hurdat_storm_id, storm_distance_km, storm_track_time)
-        VALUES %s
-        ON CONFLICT (time_step_id, hurdat_storm_id) DO NOTHING;
-    """, [(time_step_id, hurdat_storm_id, dist, storm_timestamp)
-    ])
-
-def update_buoy_time_steps(buoy_df, storm_row, dist):
-    '''for col in ['storm_name', 'storm_type', 'storm_heading_deg', 'storm_speed_kts',
-            'storm_distance_km', 'storm_section_9', 'hurdat_storm_id', 'is_storm']:
-        if col not in buoy_df.columns:
-            buoy_df[col] = None'''
-
-    storm_name = get_storm_name(storm_row['hurdat_storm_id']).iloc[0]
-    buoy_df['storm_name'] = storm_name
-    buoy_df['storm_type'] = storm_row['storm_type']
-    buoy_df['storm_heading_deg'] = storm_row['heading']
-    buoy_df['storm_speed_kts'] = storm_row['speed']
-    buoy_df['storm_distance_km'] = dist
-    buoy_df['storm_section_9'] = None
-    buoy_df['hurdat_storm_id'] = storm_row['hurdat_storm_id']
-    buoy_df['is_storm'] = True
-    return buoy_df, storm_name
-
-def haversine_km(lat1, lon1, lat2, lon2):
-    R = 6371.0  # Earth radius in km
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-    return 2 * R * atan2(sqrt(a), sqrt(1 - a))  
-
-def update_time_steps_table(cur, row_to_update, storm_name, time_step_id):
-    cur.execute("""
-        UPDATE dirspec.time_steps ts
-        SET storm_name = %s,
-            storm_type = %s,
-            storm_heading_deg = %s,
-            storm_speed_kts = %s,
-            storm_distance_km = %s,
-            storm_section_9 = %s,
-            hurdat_storm_id = %s,
-            is_storm = %s
-        WHERE ts.id = %s;
-    """, (
-        storm_name,
-        row_to_update['storm_type'], 
-        row_to_update['storm_heading_deg'], 
-        row_to_update['storm_speed_kts'],
-        row_to_update['storm_distance_km'], 
-        row_to_update['storm_section_9'], 
-        row_to_update['hurdat_storm_id'], 
-        row_to_update['is_storm'],
-        time_step_id
-    ))
\ No newline at end of file
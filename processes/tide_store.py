@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# modules
+import config.config as c
+
+# hourly tide heights per tide station, stored as one .npz partition per calendar month under
+# tidal_path/<tide station>/<YYYY-MM>.npz so any buoy using the same tide station shares the cache.
+# hourly_height is verified data that lags real time, so a month is only kept once it is final:
+# over and fully covered hourly, or older than tide_verification_lag_days (gaps by then are permanent).
+# Anything else, including failed requests, is refetched on the next run
+
+def month_starts(start, end):
+    # UTC month starts covering [start, end]
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+    start = start.tz_convert('UTC') if start.tzinfo else start.tz_localize('UTC')
+    end = end.tz_convert('UTC') if end.tzinfo else end.tz_localize('UTC')
+    first = start.normalize().replace(day=1)
+    return list(pd.date_range(first, end, freq='MS'))
+
+def partition_path(tide_station_id, month):
+    return os.path.join(c.tidal_path, str(tide_station_id), f"{month.strftime('%Y-%m')}.npz")
+
+def is_final(month, t, now):
+    # whether a month's hourly heights (t as int64 ns UTC) can be stored for good
+    month_end = month + pd.offsets.MonthBegin(1)
+    if month_end > now:
+        return False
+    if month_end + pd.Timedelta(days=c.tide_verification_lag_days) <= now:
+        return True
+    expected = int((month_end - month) / pd.Timedelta(hours=1))
+    return len(np.unique(t)) >= expected
+
+def load_partition(path):
+    with np.load(path) as part:
+        return part['t'], part['v']
+
+def save_partition(path, t, v):
+    # written to a temp file and renamed so a partially written month is never read back
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, t=t, v=v)
+    os.replace(tmp, path)
+
+# one pooled session for every tide request in the process
+_session = None
+_session_lock = threading.Lock()
+# next time (monotonic) a request may start, shared by all fetch threads
+_rate = {'lock': threading.Lock(), 'next': 0.0}
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=c.tide_retries, backoff_factor=c.tide_backoff,
+                          status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",),
+                          respect_retry_after_header=True)
+            adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=c.tide_max_workers)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+def wait_for_slot():
+    # spaces request starts at least 1 / tide_requests_per_sec apart across threads
+    if not c.tide_requests_per_sec:
+        return
+    interval = 1.0 / c.tide_requests_per_sec
+    with _rate['lock']:
+        now = time.monotonic()
+        start = max(now, _rate['next'])
+        _rate['next'] = start + interval
+    if start > now:
+        time.sleep(start - now)
+
+def fetch_tide_chunk(tide_station_id, begin, end):
+    # one CO-OPS datagetter request, begin/end as YYYYMMDD, returns (t as int64 ns UTC, v)
+    params = {
+        "station": f"{tide_station_id}",
+        "begin_date": begin,
+        "end_date": end,
+        "product": "hourly_height",
+        "datum": "MLLW",
+        "units": "metric",
+        "format": "json",
+        "time_zone": "gmt"
+    }
+    wait_for_slot()
+    response = get_session().get(c.tide_api_url, params=params, timeout=c.tide_timeout)
+    response.raise_for_status()
+    return parse_tide_json(response.json())
+
+def parse_tide_json(payload):
+    # CO-OPS reports errors with HTTP 200 and an "error" body, "No data was found" is just an empty month
+    if "error" in payload:
+        message = payload["error"].get("message", "") if isinstance(payload["error"], dict) else str(payload["error"])
+        if "no data was found" not in message.lower():
+            raise ValueError(f"CO-OPS error: {message}")
+    data = payload.get("data", [])
+    if not data:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    df = pd.DataFrame(data)
+    t = pd.to_datetime(df['t']).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    v = pd.to_numeric(df['v'], errors='coerce').to_numpy(dtype=float)
+    keep = ~np.isnan(v)
+    return t[keep], v[keep]
+
+def month_request(tide_station_id, month):
+    # (station, begin, end) for a whole calendar month
+    last_day = month + pd.offsets.MonthEnd(0)
+    return tide_station_id, month.strftime("%Y%m%d"), last_day.strftime("%Y%m%d")
+
+def fetch_month(req):
+    # a month that still fails after the retries comes back as None, so it is neither used nor cached
+    try:
+        return fetch_tide_chunk(*req)
+    except (requests.RequestException, ValueError) as e:
+        print(f"Tide request {req} failed: {e}")
+        return None
+
+def fetch_months(requests_list, max_workers=None):
+    # {(station, begin, end): (t, v) or None}, one request per month run on a bounded thread pool
+    max_workers = max_workers or c.tide_max_workers
+    if len(requests_list) <= 1 or max_workers <= 1:
+        return {req: fetch_month(req) for req in requests_list}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(requests_list))) as pool:
+        results = pool.map(fetch_month, requests_list)
+        return dict(zip(requests_list, results))
+
+def get_tide_series(tide_station_id, start, end):
+    # hourly heights covering the months of [start, end] as a UTC-indexed series
+    months = month_starts(start, end)
+    now = pd.Timestamp.now(tz='UTC')
+
+    parts = {}
+    missing = []
+    for month in months:
+        path = partition_path(tide_station_id, month)
+        if os.path.exists(path):
+            t, v = load_partition(path)
+            # partitions saved before the month was final are refetched
+            if is_final(month, t, now):
+                parts[month] = (t, v)
+                continue
+        missing.append(month)
+
+    if missing:
+        print(f"Tide station {tide_station_id}: {len(months) - len(missing)} cached months, fetching {len(missing)}")
+        fetched = fetch_months([month_request(tide_station_id, month) for month in missing])
+        for month in missing:
+            result = fetched[month_request(tide_station_id, month)]
+            if result is None:
+                parts[month] = (np.empty(0, dtype=np.int64), np.empty(0))
+                continue
+            parts[month] = result
+            if is_final(month, result[0], now):
+                save_partition(partition_path(tide_station_id, month), *result)
+
+    t = np.concatenate([parts[month][0] for month in months]) if months else np.empty(0, dtype=np.int64)
+    v = np.concatenate([parts[month][1] for month in months]) if months else np.empty(0)
+    order = np.argsort(t, kind='stable')
+    index = pd.DatetimeIndex(t[order].astype('datetime64[ns]')).tz_localize('UTC')
+    series = pd.Series(v[order], index=index)
+    return series[~series.index.duplicated()]
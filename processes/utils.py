@@ -1,59 +1,44 @@
-import json
 import numpy as np
-import os
 import pandas as pd
-import requests
-from math import radians, cos, sin, sqrt, atan2
-from datetime import timedelta
 
 # modules
 import data.query as q
+import data.ref_cache as rc
+import processes.tide_store as ts
+import processes.station_registry as sr
 import config.config as c
 
 def insert_time_steps(cur, df_time_steps, f_type):
-    for _, row in df_time_steps.iterrows():
-        buoy_id = q.get_buoy_id(row['station_id'])
-        buoy_id = [int(buoy_id.loc[0,"id"])]
-        if f_type == 'noaa-year':
-            source = 'noaa-year'
-            met_source = 'buoy'
-        elif f_type == 'noaa-api' or f_type == 'noaa-rt':
-            source = 'noaa-rt'
-            met_source = 'buoy'
-        elif f_type == 'cdip':
-            source = 'cdip'
-            met_source = 'ERA5'
-
-        if buoy_id:
-            cur.execute("""
-                INSERT INTO dirspec.time_steps (
-                    buoy_id, timestamp, WDIR, WSPD, GST, WVHT, DPD, APD, MWD, PRES,
-                    ATMP, WTMP, DEWP, VIS, PTDY, TIDE, m0, hm0, m_1, Te, P, source, met_source
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                        %s, %s, %s)
-                ON CONFLICT (buoy_id, timestamp) DO NOTHING;
-            """, (
-                buoy_id[0], row['datetime'],
-                safe_val(row.get('WDIR')), safe_val(row.get('WSPD')), safe_val(row.get('GST')), safe_val(row.get('WVHT')),
-                safe_val(row.get('DPD')), safe_val(row.get('APD')), safe_val(row.get('MWD')), safe_val(row.get('PRES')),
-                safe_val(row.get('ATMP')), safe_val(row.get('WTMP')), safe_val(row.get('DEWP')), safe_val(row.get('VIS')),
-                safe_val(row.get('PTDY')), safe_val(row.get('TIDE')), safe_val(row.get('m0')), safe_val(row.get('hm0')),
-                safe_val(row.get('m_1')), safe_val(row.get('Te')), safe_val(row.get('P')), source, met_source
-            ))
+    import data.copy_writer as cw
+
+    if f_type == 'noaa-year':
+        source = 'noaa-year'
+        met_source = 'buoy'
+    elif f_type == 'noaa-api' or f_type == 'noaa-rt':
+        source = 'noaa-rt'
+        met_source = 'buoy'
+    elif f_type == 'cdip':
+        source = 'cdip'
+        met_source = 'ERA5'
+
+    # resolve buoy ids per station, rows for unknown stations are dropped
+    station_ids = df_time_steps['station_id'].astype(str)
+    buoy_ids = station_ids.map({s_id: rc.get_buoy_id(s_id) for s_id in station_ids.unique()})
+    known = buoy_ids.notna()
+
+    inserted, skipped = cw.copy_time_steps(cur, df_time_steps[known], buoy_ids[known], source, met_source)
+    print(f"Timesteps inserted: {inserted}, skipped as existing: {skipped}.")
+    return inserted, skipped
 
 def get_unprocessed_timesteps(cur,station_id):
     # Step 1: get buoy_id from station_id
-    buoy = q.get_buoy_id(station_id)
-    buoy = [int(buoy.loc[0,"id"])]
-    if not buoy:
+    buoy_id = rc.get_buoy_id(station_id)
+    if buoy_id is None:
         return []
-    buoy_id = buoy[0]
 
-    # Step 2: get time steps where spectra_ingested is false
+    # Step 2: get time steps where spectra_ingested is false, ids come along for the id map
     cur.execute("""
-        SELECT timestamp
+        SELECT timestamp, id
         FROM dirspec.time_steps
         WHERE buoy_id = %s AND (spectra_ingested = FALSE OR spectra_ingested IS NULL)
         ORDER BY timestamp
@@ -61,16 +46,79 @@ def get_unprocessed_timesteps(cur,station_id):
 
     return cur.fetchall() 
 
-def get_time_step_id(cur, station_id, dt_utc):
-    cur.execute("""
-        SELECT ts.id
+def get_time_step_id_map(cur, station_id, start=None, end=None):
+    # all timestep ids for a buoy in one query, optionally limited to a time window
+    query = """
+        SELECT ts.timestamp, ts.id
         FROM dirspec.time_steps ts
         JOIN dirspec.buoys b ON ts.buoy_id = b.id
-        WHERE b.station_id = %s AND ts.timestamp = %s
-    """, (station_id, dt_utc))
-    
-    result = cur.fetchone()
-    return result[0] if result else None
+        WHERE b.station_id = %s
+    """
+    params = [station_id]
+    if start is not None and end is not None:
+        query += " AND ts.timestamp BETWEEN %s AND %s"
+        params += [start, end]
+    cur.execute(query, params)
+    return time_step_id_map(cur.fetchall())
+
+def time_step_id_map(rows):
+    # (timestamp, id) rows -> id series indexed by UTC timestamp
+    rows = [row for row in rows if row and row[0] is not None]
+    index = pd.to_datetime([row[0] for row in rows], utc=True)
+    return pd.Series([int(row[1]) for row in rows], index=index, dtype='int64')
+
+def align_time_step_ids(id_map, datetimes):
+    # look up the id for each datetime in memory, -1 where the timestep isn't in the map
+    pos = id_map.index.get_indexer(pd.DatetimeIndex(datetimes))
+    return np.where(pos >= 0, id_map.to_numpy()[pos], -1)
+
+# file types read from NDBC realtime2 data, these keep a per-station ingest mark
+realtime_types = ('noaa-rt', 'noaa-api')
+
+def frames_after_mark(mark, *frames):
+    # keep only rows newer than the station's mark (naive UTC), frames unchanged without a mark
+    if mark is None:
+        return frames
+    mark = pd.Timestamp(mark).tz_localize('UTC')
+    return tuple(df[df['datetime'] > mark].reset_index(drop=True) for df in frames)
+
+def update_ingest_mark(station_id, f_type, df_txt):
+    # after a realtime station's new rows are fully processed, move its mark to the newest one
+    import data.db as db
+    if f_type not in realtime_types or df_txt.empty:
+        return
+    newest = pd.Timestamp(df_txt['datetime'].max()).tz_convert('UTC').tz_localize(None)
+    with db.session() as s:
+        q.set_ingest_mark(s.cur, str(station_id), 'noaa-rt', newest.to_pydatetime())
+
+def register_realtime_deployment(station_id, df_txt):
+    # one realtime deployment per station at the NDBC station position, each batch extends its
+    # start/end instead of adding a row. Returns the deployment id
+    import data.db as db
+    row = get_noaa_station_row(station_id)
+    if row.empty:
+        raise ValueError(f"Station {station_id} is not in the NDBC station list")
+    row = row.iloc[0]
+
+    if rc.get_buoy_id(station_id) is None:
+        with db.session() as s:
+            q.insert_buoy(s.cur, {'station_id': station_id, 'name': str(row['name']), 'project': 'NOAA'})
+
+    timestamps = df_txt['datetime']
+    deployment_id = f"NOAA-{station_id}-rt"
+    buoy_deploy = {
+        'buoy_id': rc.get_buoy_id(station_id),
+        'deployment_id': deployment_id,
+        'start_time': timestamps.min(),
+        'end_time': timestamps.max(),
+        'latitude': row['lat'],
+        'longitude': row['lon'],
+        'deployment_type': 'NOAA',
+        'depth': None
+    }
+    with db.session() as s:
+        q.upsert_realtime_deployment(s.cur, buoy_deploy)
+    return deployment_id
 
 def datetime_dfs(x,buoy_id):
     new_columns = ['year','month','day','hour','minute']
@@ -80,175 +128,57 @@ def datetime_dfs(x,buoy_id):
     x.drop(['year', 'month', 'day', 'hour', 'minute'], axis='columns',inplace=True)
     return x
 
-def safe_val(val):
-    return None if pd.isna(val) else val
-
 def met_to_math_dir(angle_deg):
     return np.deg2rad((270 - angle_deg) % 360)
 
 def math_to_met_dir(angle_rad):
     return (270 - np.degrees(angle_rad)) % 360
 
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # Earth radius in km
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-    return 2 * R * atan2(sqrt(a), sqrt(1 - a))
-
 def get_noaa_station_row(station_id):
-    station_list = pd.read_xml(c.noaa_stations_path)
-    station_list['id'] = station_list['id'].astype(str)
-    row = station_list.loc[station_list['id'] == str(station_id)]
-    return row
-
-def df_txt_calcs(df_txt, df_data_spec):
-    bandwidths = c.noaa_bandwidths
-
-    # do calculations for specific timestep -> df_txt is timestep output table
-    calc = df_data_spec.iloc[:, -46:].values * bandwidths
-    
-    # zeroth moment and Hm0
-    df_txt['m0'] = calc.sum(axis=1)
-    df_txt['hm0'] = np.sqrt(df_txt['m0'])*4
-    calc2 = calc / c.noaa_freqs
-    
-    # 1st moment, energy period, and wave power
-    df_txt['m_1'] = calc2.sum(axis=1)
-    df_txt['Te'] = df_txt['m_1'] / df_txt['m0']
-    df_txt['P'] = (1025 * 9.81**2 * df_txt['hm0']**2 * df_txt['Te']) / (64 * np.pi * 1000)
+    # served from the station registry, parsed once per process
+    return sr.get_station('ndbc', station_id)
+
+def df_txt_calcs(df_txt, df_data_spec, df_swdir=None, df_swr1=None):
+    from processes.spectral_moments import bulk_parameters
+
+    def to_array(df):
+        # every column but the id/time/separation-frequency ones is a frequency bin, in config order
+        spectrum = df.drop(columns=['station_id', 'datetime', 'sep_freq'], errors='ignore')
+        if spectrum.shape[1] != len(c.noaa_freqs):
+            raise ValueError(f"Expected {len(c.noaa_freqs)} frequency columns, got {spectrum.shape[1]}")
+        return spectrum.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+
+    # spectral moments, periods, width, peak and (with swdir/swr1) mean direction and spread
+    # for every timestep at once -> df_txt is timestep output table
+    Ef = to_array(df_data_spec)
+    r1 = to_array(df_swr1) if df_swr1 is not None else None
+    alpha1 = to_array(df_swdir) if df_swdir is not None else None
+    params = bulk_parameters(Ef, c.noaa_freqs, c.noaa_bandwidths, r1, alpha1, c.direction_bands)
+    for name, values in params.items():
+        df_txt[name] = values
 
     # convert the station ids to strings
     df_txt['station_id'] = df_txt['station_id'].astype(str)
     return df_txt
 
 def get_enso_index(df_txt):
-    mei_seasons = ["DJ", "JF", "FM", "MA", "AM", "MJ", "JJ", "JA", "AS", "SO", "ON", "ND"]
-    mei_season_match = {
-        "DJ": 12, "JF": 1, "FM": 2, "MA": 3, "AM": 4, "MJ": 5, 
-        "JJ": 6, "JA": 7, "AS": 8, "SO": 9, "ON": 10, "ND": 11
-    }
-    meiv2_path = r"D:\fetch_buoy_data\resources\meiv2.data"
-    
-    # load in mei data and melt
-    mei_df = pd.read_csv(meiv2_path, header=None, sep='\s+', names=mei_seasons)
-    mei_df = mei_df.reset_index()
-    mei_df.rename(columns={'index': 'year'},inplace=True)
-    mei_long = mei_df.melt(id_vars='year', var_name='month', value_name='MEI')
-    mei_long['month'] = mei_long['month'].map(mei_season_match)
-    mei_long['datetime'] = pd.to_datetime(dict(year=mei_long['year'], month=mei_long['month'], day=1))
-    mei_long = mei_long[['datetime', 'MEI']]
-
-    # get year and month from buoy timesteps
-    df_txt['year'] = df_txt['datetime'].dt.year
-    df_txt['month'] = df_txt['datetime'].dt.month
-    
-    # get year and month from mei data
-    mei_long['year'] = mei_long['datetime'].dt.year
-    mei_long['month'] = mei_long['datetime'].dt.month
-
-    # merge on year and month
-    df_txt = df_txt.merge(
-        mei_long[['year', 'month', 'MEI']],
-        on=['year', 'month'],
-        how='left'
-    )
-    df_txt.drop(columns=['year', 'month'], inplace=True)
-
-    return df_txt
-
-def date_chunks(start_date, end_date, days=30):
-    start = pd.to_datetime(start_date)
-    end = pd.to_datetime(end_date)
-    
-    chunks = []
-    while start < end:
-        chunk_end = min(start + timedelta(days=days), end)
-        chunks.append((start.strftime("%Y%m%d"), chunk_end.strftime("%Y%m%d")))
-        start = chunk_end + timedelta(days=1)
-    return chunks
+    # MEI v2 values attached in place from the cached climate index table
+    from processes.climate_index import attach_climate_indices
+    return attach_climate_indices(df_txt, ['MEI'])
 
 def get_tidal_data(df_txt, deployment):
-    with open(c.stations_path, 'r') as f:
-        stations = json.load(f)['stations']
-
-    # Convert to DataFrame
-    df_stations = pd.DataFrame([{
-        'id': s['id'],
-        'name': s['name'],
-        'lat': s['lat'],
-        'lon': s['lng'],
-        'state': s.get('state', None)
-    } for s in stations])
-
     # get station lat and lon
-    buoy_id = q.get_buoy_id(df_txt.loc[0,'station_id'])
-    df_lat_lon = q.get_station_lat_lon(int(buoy_id.loc[0,'id']), str(deployment))
-
-    # calculate haversine distances
-    df_stations['distance_km'] = df_stations.apply(
-        lambda row: haversine(df_lat_lon.loc[0,'lat'], df_lat_lon.loc[0,'lon'], row['lat'], row['lon']),
-        axis=1
-    )
+    buoy_id = rc.get_buoy_id(df_txt.loc[0,'station_id'])
+    df_lat_lon = q.get_station_lat_lon(buoy_id, str(deployment))
 
-    # pull the closest tidal station from the list
-    closest = df_stations.sort_values('distance_km').iloc[0]
+    # pull the closest tidal station from the registry's KD-tree
+    closest = sr.nearest('coops', df_lat_lon.loc[0,'lat'], df_lat_lon.loc[0,'lon'], k=1).iloc[0]
     tide_station_id = closest['id']
     print(f"Closest tide station: {closest['id']} - {closest['name']} ({closest['distance_km']:.1f} km)")
 
-    # get min and max date to pull from api
+    # hourly tide heights for the frame, served from the monthly tide store
     timestamps = pd.to_datetime(df_txt['datetime'])
-    begin_date = timestamps.min().strftime("%Y%m%d")
-    end_date = timestamps.max().strftime("%Y%m%d")
-
-    # check if there's already a cached file for this data
-    cache_file = f"{c.tidal_path}/{tide_station_id}/tide_{tide_station_id}_{begin_date}_{end_date}.csv"
-    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
-
-    if os.path.exists(cache_file):
-        print(f"Loading cached tide data: {cache_file}")
-        tide_df = pd.read_csv(cache_file, parse_dates=['t'])
-
-    else:
-        # make 1 month date chunks
-        chunks = date_chunks(begin_date, end_date, days=30)
-
-        all_data = []
-        for begin, end in chunks:
-            # make api call for tidal data
-            params = {
-                "station": f"{tide_station_id}",
-                "begin_date": begin,
-                "end_date": end,
-                "product": "hourly_height",
-                "datum": "MLLW",
-                "units": "metric",
-                "format": "json",
-                "time_zone": "gmt"
-            }
-
-            response = requests.get("https://api.tidesandcurrents.noaa.gov/api/prod/datagetter", params=params)
-            chunk_data = response.json().get("data", [])
-            if chunk_data:
-                chunk_df = pd.DataFrame(chunk_data)
-                all_data.append(chunk_df)
-
-        if all_data:
-            tide_df = pd.concat(all_data, ignore_index=True)
-            tide_df['t'] = pd.to_datetime(tide_df['t'])
-            tide_df['v'] = pd.to_numeric(tide_df['v'], errors='coerce')
-            tide_df = tide_df.dropna(subset=['v'])
-            tide_df[['t', 'v']].to_csv(cache_file, index=False)
-
-    # NOAA tide data (hourly)
-    tide_df['t'] = pd.to_datetime(tide_df['t'])
-    tide_df['v'] = pd.to_numeric(tide_df['v'], errors='coerce')
-    tide_df = tide_df.sort_values('t') # just in case the data times comes in mixed up, though unlikely
-    tide_df = tide_df.dropna()
-
-    # make a series for the tidal times for joining, set tz at UTC
-    tide_series = pd.Series(tide_df['v'].values, index=tide_df['t'])
-    tide_series.index = tide_series.index.tz_localize('UTC')
+    tide_series = ts.get_tide_series(tide_station_id, timestamps.min(), timestamps.max())
 
     # pull out the buoy times so that they can be merged on
     buoy_times = pd.to_datetime(df_txt['datetime'], utc=True)
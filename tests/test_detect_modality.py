@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from scipy.ndimage import gaussian_filter1d
+from scipy.signal import find_peaks
+
+from processes.detect_modality import _prominent_peaks, detect_modality_batch, detect_modality_from_dmatrix
+
+# detect_modality_batch re-implements find_peaks' plateau, edge and prominence rules,
+# so its labels are checked against the per-matrix reference on awkward inputs
+
+def reference_labels(S_stack, **kwargs):
+    return np.array([detect_modality_from_dmatrix(S, **kwargs) for S in S_stack], dtype=object)
+
+def random_stack(rng, n_t=40, n_f=12, n_dir=72):
+    return rng.random((n_t, n_f, n_dir))
+
+def plateau_stack(rng, n_t=40, n_f=12, n_dir=72):
+    # few distinct levels, so flat tops and flat valleys of every width show up
+    return np.round(rng.random((n_t, n_f, n_dir)) * 3) / 3
+
+def lobed_stack(rng, n_t=40, n_f=12, n_dir=72):
+    # one or two von Mises-like lobes, some centred on the 0/360 seam so peaks sit at the row edges
+    theta = np.linspace(0, 2 * np.pi, n_dir, endpoint=False)
+    centres = rng.choice([0.0, theta[-1], np.pi / 2, np.pi, 3 * np.pi / 2], size=(n_t, n_f, 2))
+    weights = rng.random((n_t, n_f, 2)) * (rng.random((n_t, n_f, 1)) < 0.5)
+    weights[..., 0] = 1.0
+    lobes = np.exp(4 * (np.cos(theta[None, None, None, :] - centres[..., None]) - 1))
+    return (weights[..., None] * lobes).sum(axis=2)
+
+@pytest.mark.parametrize('make_stack', [random_stack, plateau_stack, lobed_stack])
+@pytest.mark.parametrize('n_dir', [36, 72, 360])
+def test_batch_matches_reference(make_stack, n_dir):
+    rng = np.random.default_rng(n_dir)
+    S_stack = make_stack(rng, n_dir=n_dir)
+    np.testing.assert_array_equal(detect_modality_batch(S_stack), reference_labels(S_stack))
+
+@pytest.mark.parametrize('make_stack', [random_stack, plateau_stack, lobed_stack])
+def test_peak_mask_matches_find_peaks(make_stack):
+    # row by row, the vectorised peak search finds exactly what find_peaks finds
+    rng = np.random.default_rng(2)
+    rows = make_stack(rng, n_t=20, n_dir=72).reshape(-1, 72)
+    rows[::17] = np.nan
+    # raw rows keep the exact plateaus, smoothed rows are what detect_modality_batch searches
+    for x in (rows, gaussian_filter1d(rows, sigma=2, axis=-1)):
+        for min_rel in (0.0, 0.05, 0.3):
+            threshold = min_rel * np.max(x, axis=1)
+            mask = _prominent_peaks(x, threshold)
+            for row, row_mask, t in zip(x, mask, threshold):
+                peaks, _ = find_peaks(row, prominence=t)
+                np.testing.assert_array_equal(np.flatnonzero(row_mask), peaks)
+
+def test_all_nan_and_empty_rows():
+    rng = np.random.default_rng(0)
+    S_stack = lobed_stack(rng, n_t=6)
+    S_stack[0, 3] = np.nan          # one all-NaN frequency row
+    S_stack[1] = np.nan             # an all-NaN timestep
+    S_stack[2] = 0.0                # no energy -> undetermined
+    S_stack[3, :5] = 0.0            # some empty frequency rows
+    np.testing.assert_array_equal(detect_modality_batch(S_stack), reference_labels(S_stack))
+
+def test_peaks_on_wrap_edge():
+    # the second lobe straddles 0/360, so its maximum is an edge bin that find_peaks never reports
+    n_dir = 72
+    theta = np.linspace(0, 2 * np.pi, n_dir, endpoint=False)
+    row = np.exp(4 * (np.cos(theta - np.pi) - 1)) + np.exp(4 * (np.cos(theta) - 1))
+    S_stack = np.stack([np.tile(row, (8, 1)), np.tile(np.roll(row, 3), (8, 1))])
+    np.testing.assert_array_equal(detect_modality_batch(S_stack), reference_labels(S_stack))
+
+def test_block_rows_does_not_change_labels():
+    rng = np.random.default_rng(1)
+    S_stack = plateau_stack(rng)
+    np.testing.assert_array_equal(detect_modality_batch(S_stack, block_rows=7), detect_modality_batch(S_stack))
@@ -0,0 +1,103 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+
+import config.config as c
+import fetch_data.fetch_from_api as fa
+
+# fetch_many_from_api against a local http.server standing in for the NDBC realtime2 directory (c.url)
+
+freqs = np.array([0.05, 0.1, 0.15])
+times = pd.date_range('2024-03-01 00:00', periods=4, freq='30min')[::-1]
+
+def txt_file():
+    lines = ['#YY  MM DD hh mm WDIR WSPD GST  WVHT   DPD   APD MWD   PRES  ATMP  WTMP  DEWP  VIS PTDY  TIDE',
+             '#yr  mo dy hr mn degT m/s  m/s     m   sec   sec degT   hPa  degC  degC  degC  nmi  hPa    ft']
+    for i, t in enumerate(times):
+        lines.append(f'{t:%Y %m %d %H %M} 180 5.0 6.0 {1.0 + i / 10:.1f} 8 6.0 90 1013.0 20.0 21.0 MM MM MM MM')
+    return '\n'.join(lines) + '\n'
+
+def spectral_file(offset, has_sep_freq=False):
+    lines = ['#YY  MM DD hh mm' + (' Sep_Freq' if has_sep_freq else '') + '  < spec_1 (freq_1) ... >']
+    for i, t in enumerate(times):
+        lead = f'{t:%Y %m %d %H %M}' + (' 0.180' if has_sep_freq else '')
+        lines.append(lead + ' ' + ' '.join(f'{offset + i + j / 10:.1f} ({f:.3f})' for j, f in enumerate(freqs)))
+    return '\n'.join(lines) + '\n'
+
+files = {
+    '/realtime2/41001.txt': txt_file(),
+    '/realtime2/41001.data_spec': spectral_file(0, has_sep_freq=True),
+    '/realtime2/41001.swdir': spectral_file(100),
+    '/realtime2/41001.swdir2': spectral_file(200),
+    '/realtime2/41001.swr1': spectral_file(300),
+    '/realtime2/41001.swr2': spectral_file(400),
+}
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def ndbc_server(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(c, 'url', f'http://127.0.0.1:{server.server_address[1]}/realtime2/')
+    monkeypatch.setattr(c, 'rt_retries', 0)
+    # set in the module dict so the WPM sheet is never read
+    monkeypatch.setitem(vars(c), 'noaa_freqs', freqs)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_fetch_many_from_local_server(ndbc_server):
+    results = fa.fetch_many_from_api(['41001', '41002'], save_raw=False)
+
+    df_txt, df_data_spec, df_swdir, df_swdir2, df_swr1, df_swr2 = results['41001']
+    expected_times = pd.DatetimeIndex(times).tz_localize('UTC')
+    for frame in results['41001']:
+        assert pd.DatetimeIndex(frame['datetime']).equals(expected_times)
+    assert df_txt['WVHT'].tolist() == [1.0, 1.1, 1.2, 1.3]
+    np.testing.assert_allclose(df_data_spec['sep_freq'], 0.18)
+    np.testing.assert_allclose(df_swdir[[1, 2, 3]].to_numpy()[1], [101.0, 101.1, 101.2], rtol=1e-6)
+    np.testing.assert_allclose(df_swr2[[1, 2, 3]].to_numpy()[3], [403.0, 403.1, 403.2], rtol=1e-6)
+
+    # a station without files comes back as its exception
+    assert isinstance(results['41002'], requests.HTTPError)
+
+def test_parsing_runs_off_the_event_loop(ndbc_server, monkeypatch):
+    threads = []
+    frames_from_texts = fa.frames_from_texts
+
+    def record(*args):
+        threads.append(threading.get_ident())
+        return frames_from_texts(*args)
+
+    monkeypatch.setattr(fa, 'frames_from_texts', record)
+    fa.fetch_many_from_api(['41001'], save_raw=False)
+    # asyncio.run drives the loop on this thread, the parse must not
+    assert threads and threading.get_ident() not in threads
+
+def test_mark_keeps_only_newer_rows(ndbc_server):
+    mark = times[1].to_pydatetime()
+    df_txt, df_data_spec, *_ = fa.fetch_from_api('41001', None, save_raw=False, mark=mark)
+    assert pd.DatetimeIndex(df_data_spec['datetime']).equals(pd.DatetimeIndex(times[:1]).tz_localize('UTC'))
+    assert len(df_txt) == 1
+
+    assert fa.fetch_from_api('41001', None, save_raw=False, mark=times[0].to_pydatetime()) is None
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from processes.calc_D import compute_D, modality_sigma
+from processes.detect_modality import detect_modality_batch
+from processes.modality_bootstrap import bootstrap_modality, perturb_fourier
+
+# bootstrap_modality stops classifying a replicate once its label is settled and skips rows and
+# timesteps the replicates cannot change, so it is checked against every replicate run in full
+
+def reference_conf(Ef, alpha1, alpha2, r1, r2, labels, n_replicates, dof, resolution_deg, seed, block_size=8):
+    rng = np.random.default_rng(seed)
+    n_t, n_f = Ef.shape
+    conf = np.empty(n_t)
+    for start in range(0, n_t, block_size):
+        stop = min(start + block_size, n_t)
+        n_b = stop - start
+        reps = perturb_fourier(alpha1[start:stop], alpha2[start:stop], r1[start:stop], r2[start:stop], n_replicates, dof, rng)
+        Ef_rep = np.broadcast_to(Ef[start:stop], (n_replicates, n_b, n_f)).reshape(-1, n_f)
+        _, S_rep = compute_D(Ef_rep, *(x.reshape(-1, n_f) for x in reps), resolution_deg)
+        rep_labels = detect_modality_batch(S_rep, direction_smoothing=modality_sigma(resolution_deg)).reshape(n_replicates, n_b)
+        conf[start:stop] = np.mean(rep_labels == labels[start:stop][None, :], axis=0)
+    return conf
+
+def fourier_inputs(rng, n_t=20, n_f=46):
+    # an aligned single system on the first half, crossing seas on the rest, plus rows without energy and a NaN bin
+    Ef = rng.random((n_t, n_f)) ** 3
+    Ef[:3] = 0.0
+    Ef[5, 40:] = 1e-9
+    base = rng.uniform(0, 2 * np.pi, (n_t, 1))
+    crossing = (np.arange(n_t) >= n_t // 2)[:, None] & (rng.random((n_t, n_f)) < 0.3)
+    alpha1 = base + np.where(crossing, 2.0, 0.0) + rng.normal(0, 0.2, (n_t, n_f))
+    alpha2 = alpha1 + rng.normal(0, 0.1, (n_t, n_f))
+    r1 = rng.uniform(0.1, 0.9, (n_t, n_f))
+    r2 = np.where(crossing.any(axis=1, keepdims=True), r1 ** 2, rng.uniform(0.05, 0.3, (n_t, n_f)))
+    r2 = np.clip(r2 + rng.normal(0, 0.05, (n_t, n_f)), 0, 1)
+    r1[7, 10] = np.nan
+    return Ef, alpha1, alpha2, r1, r2
+
+@pytest.mark.parametrize('resolution_deg', [5, 10])
+def test_bootstrap_matches_full_replicates(resolution_deg):
+    rng = np.random.default_rng(resolution_deg)
+    Ef, alpha1, alpha2, r1, r2 = fourier_inputs(rng)
+    _, S = compute_D(Ef, alpha1, alpha2, r1, r2, resolution_deg)
+    labels = detect_modality_batch(S, direction_smoothing=modality_sigma(resolution_deg))
+    assert set(labels) == {'undetermined', 'unimodal', 'bimodal'}
+
+    conf = bootstrap_modality(Ef, alpha1, alpha2, r1, r2, labels, n_replicates=40, resolution_deg=resolution_deg, seed=[3, 1])
+    expected = reference_conf(Ef, alpha1, alpha2, r1, r2, labels, 40, 32, resolution_deg, [3, 1])
+    np.testing.assert_array_equal(conf, expected)
+
+def test_undetermined_timesteps_are_certain():
+    rng = np.random.default_rng(0)
+    Ef, alpha1, alpha2, r1, r2 = fourier_inputs(rng)
+    labels = np.array(['undetermined'] * 3 + ['unimodal'] * 17, dtype=object)
+    conf = bootstrap_modality(Ef, alpha1, alpha2, r1, r2, labels, n_replicates=10)
+    np.testing.assert_array_equal(conf[:3], 1.0)
@@ -0,0 +1,113 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fetch_data.ndbc_parser import aligned_frames, parse_spectral_text
+
+# parse_spectral_text replaced pd.read_csv for the NDBC spectral files, so both layouts are checked
+# against the pandas reads the fetchers used, on files with MM, 999.0 and an extra frequency bin
+
+freqs = np.round(np.arange(0.02, 0.4851, 0.005), 4)
+
+def make_values(rng, n_rows, n_cols):
+    # text values with the missing-value markers and some valid 99.0 directions mixed in
+    values = rng.uniform(0, 360, (n_rows, n_cols)).round(1).astype(str)
+    values[rng.random((n_rows, n_cols)) < 0.05] = 'MM'
+    values[rng.random((n_rows, n_cols)) < 0.05] = '999.0'
+    values[rng.random((n_rows, n_cols)) < 0.05] = '99.0'
+    return values
+
+def times(n_rows):
+    return pd.date_range('2024-01-01', periods=n_rows, freq='30min')[::-1]
+
+def realtime_text(rng, n_rows=50, has_sep_freq=False):
+    # realtime2 layout: value (freq) pairs inline, with a 0.0100 bin the config does not use
+    file_freqs = np.concatenate([[0.01], freqs])
+    values = make_values(rng, n_rows, len(file_freqs))
+    lines = ['#YY  MM DD hh mm' + (' Sep_Freq' if has_sep_freq else '') + '  < spec_1 (freq_1) ... >']
+    for t, row in zip(times(n_rows), values):
+        lead = f'{t:%Y %m %d %H %M}' + (' 0.180' if has_sep_freq else '')
+        lines.append(lead + ' ' + ' '.join(f'{v} ({f:.3f})' for v, f in zip(row, file_freqs)))
+    return '\n'.join(lines) + '\n'
+
+def year_text(rng, n_rows=50):
+    # historical layout: frequencies in the header line, again with an extra .0100 bin
+    file_freqs = np.concatenate([[0.01], freqs])
+    values = make_values(rng, n_rows, len(file_freqs))
+    lines = ['YYYY MM DD hh mm ' + ' '.join(f'{f:.4f}'.lstrip('0') for f in file_freqs)]
+    for t, row in zip(times(n_rows)[::-1], values):
+        lines.append(f'{t:%Y %m %d %H %M} ' + ' '.join(row))
+    return '\n'.join(lines) + '\n'
+
+def pandas_realtime(text, has_sep_freq):
+    df = pd.read_csv(io.StringIO(text), sep=r'\s+', skiprows=[0], na_values=['MM', '999.0'], header=None)
+    n_lead = 6 if has_sep_freq else 5
+    datetimes = pd.to_datetime(df.iloc[:, :5].set_axis(['year', 'month', 'day', 'hour', 'minute'], axis=1))
+    # drop the 0.0100 pair, then every other column is a value
+    values = df.iloc[:, n_lead + 2::2].to_numpy(dtype=float)
+    sep_freq = df.iloc[:, 5].to_numpy(dtype=float) if has_sep_freq else None
+    return datetimes.to_numpy(), values, sep_freq
+
+def pandas_year(text):
+    df = pd.read_csv(io.StringIO(text), sep=r'\s+', na_values=['MM', '999.0'])
+    datetimes = pd.to_datetime(df.iloc[:, :5].set_axis(['year', 'month', 'day', 'hour', 'minute'], axis=1))
+    return datetimes.to_numpy(), df.iloc[:, 6:].to_numpy(dtype=float)
+
+@pytest.mark.parametrize('has_sep_freq', [False, True])
+def test_realtime_matches_pandas(has_sep_freq):
+    text = realtime_text(np.random.default_rng(0), has_sep_freq=has_sep_freq)
+    parsed = parse_spectral_text(text, freqs, 'realtime', has_sep_freq)
+    datetimes, values, sep_freq = pandas_realtime(text, has_sep_freq)
+
+    np.testing.assert_array_equal(parsed['datetime'], datetimes)
+    np.testing.assert_allclose(parsed['values'], values, rtol=1e-6)
+    if has_sep_freq:
+        np.testing.assert_allclose(parsed['sep_freq'], sep_freq, rtol=1e-6)
+    else:
+        assert parsed['sep_freq'] is None
+
+def test_year_matches_pandas():
+    text = year_text(np.random.default_rng(1))
+    parsed = parse_spectral_text(text, freqs, 'year')
+    datetimes, values = pandas_year(text)
+
+    np.testing.assert_array_equal(parsed['datetime'], datetimes)
+    np.testing.assert_allclose(parsed['values'], values, rtol=1e-6)
+
+@pytest.mark.parametrize('layout', ['realtime', 'year'])
+def test_99_is_a_valid_value(layout):
+    text = realtime_text(np.random.default_rng(2)) if layout == 'realtime' else year_text(np.random.default_rng(2))
+    parsed = parse_spectral_text(text, freqs, layout)
+    assert (parsed['values'] == 99.0).any()
+
+def test_two_digit_years_and_empty_body():
+    parsed = parse_spectral_text('YY MM DD hh mm .0200 .0250\n99 12 31 23 30 1.0 2.0\n', [0.02, 0.025], 'year')
+    np.testing.assert_array_equal(parsed['datetime'], np.array(['1999-12-31T23:30'], dtype='datetime64[ns]'))
+
+    parsed = parse_spectral_text('#YY  MM DD hh mm\n', freqs, 'realtime')
+    assert parsed['values'].shape == (0, len(freqs))
+
+def test_missing_band_raises():
+    text = year_text(np.random.default_rng(3), n_rows=3).replace('.0250', '.0900', 1)
+    with pytest.raises(ValueError):
+        parse_spectral_text(text, freqs, 'year')
+
+def test_aligned_frames_drops_duplicate_timestamps():
+    # a repeated timestamp keeps its first row, in every spectral file and in df_txt
+    def parsed_for(stamps, offset):
+        values = np.arange(len(stamps), dtype=np.float32)[:, None] + offset + np.zeros((1, 3), dtype=np.float32)
+        return {'datetime': np.array(stamps, dtype='datetime64[ns]'), 'values': values, 'sep_freq': None}
+
+    stamps = ['2021-01-01T00:00', '2021-01-01T01:00', '2021-01-01T02:00']
+    parsed = {ext: parsed_for(stamps, i) for i, ext in enumerate(['data_spec', 'swdir', 'swdir2', 'swr1', 'swr2'])}
+    parsed['swdir'] = parsed_for(['2021-01-01T01:00', '2021-01-01T00:00', '2021-01-01T01:00', '2021-01-01T02:00'], 10)
+    df_txt = pd.DataFrame({'datetime': pd.to_datetime(['2021-01-01 02:00', '2021-01-01 00:00', '2021-01-01 02:00',
+                                                       '2021-01-01 01:00'], utc=True), 'WVHT': [1, 2, 3, 4]})
+
+    frames = aligned_frames('41001', df_txt, parsed)
+    for frame in frames:
+        assert frame['datetime'].tolist() == frames[1]['datetime'].tolist()
+    assert frames[0]['WVHT'].tolist() == [2, 4, 1]
+    assert frames[2][1].tolist() == [11.0, 10.0, 13.0]
@@ -0,0 +1,93 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import config.config as c
+import processes.tide_store as ts
+
+# the tide fetch against a local http.server standing in for the CO-OPS datagetter (c.tide_api_url)
+
+def month_payload(begin):
+    # hourly heights for the whole month starting at begin (YYYYMMDD), value = hours since the month start / 100
+    hours = pd.date_range(pd.Timestamp(begin), pd.Timestamp(begin) + pd.offsets.MonthBegin(1), freq='h', inclusive='left')
+    return {'metadata': {'id': '8410140'},
+            'data': [{'t': f'{t:%Y-%m-%d %H:%M}', 'v': f'{i / 100:.3f}', 's': '0.003', 'f': '0,0', 'q': 'v'}
+                     for i, t in enumerate(hours)]}
+
+class Handler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = {key: value[0] for key, value in parse_qs(parsed.query).items()}
+        Handler.requests.append(params)
+        if parsed.path != '/datagetter':
+            self.send_error(404)
+            return
+        if params['station'] == 'bad':
+            payload = {'error': {'message': 'Wrong Station ID'}}
+        elif params['begin_date'] >= '20200301':
+            payload = {'error': {'message': 'No data was found. This product may not be offered at this station'}}
+        else:
+            payload = month_payload(params['begin_date'])
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def tide_server(monkeypatch, tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    Handler.requests = []
+    monkeypatch.setattr(c, 'tide_api_url', f'http://127.0.0.1:{server.server_address[1]}/datagetter')
+    monkeypatch.setattr(c, 'tidal_path', str(tmp_path))
+    monkeypatch.setattr(c, 'tide_requests_per_sec', 0)
+    monkeypatch.setattr(c, 'tide_retries', 0)
+    monkeypatch.setattr(ts, '_session', None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_fetch_tide_chunk(tide_server):
+    t, v = ts.fetch_tide_chunk('8410140', '20200101', '20200131')
+
+    assert Handler.requests == [{'station': '8410140', 'begin_date': '20200101', 'end_date': '20200131',
+                                 'product': 'hourly_height', 'datum': 'MLLW', 'units': 'metric',
+                                 'format': 'json', 'time_zone': 'gmt'}]
+    assert len(t) == 31 * 24
+    assert t[0] == pd.Timestamp('2020-01-01').value
+    np.testing.assert_allclose(v[:3], [0.0, 0.01, 0.02])
+
+def test_error_body_is_not_cached(tide_server):
+    assert ts.fetch_month(ts.month_request('bad', pd.Timestamp('2020-01-01', tz='UTC'))) is None
+
+    series = ts.get_tide_series('bad', '2020-01-05', '2020-01-06')
+    assert series.empty
+    ts.get_tide_series('bad', '2020-01-05', '2020-01-06')
+    assert len(Handler.requests) == 3
+
+def test_series_is_served_from_the_month_partitions(tide_server):
+    # January and February come back whole, March reports no data
+    series = ts.get_tide_series('8410140', '2020-01-20', '2020-03-10')
+
+    assert len(series) == (31 + 29) * 24
+    assert series.index.tz is not None and series.index.is_monotonic_increasing
+    assert series[pd.Timestamp('2020-02-01 01:00', tz='UTC')] == pytest.approx(0.01)
+    assert len(Handler.requests) == 3
+
+    # all three months are past the verification lag, so they are read back from disk, the empty one included
+    again = ts.get_tide_series('8410140', '2020-01-20', '2020-03-10')
+    pd.testing.assert_series_equal(again, series)
+    assert len(Handler.requests) == 3